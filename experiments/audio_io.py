@@ -0,0 +1,241 @@
+import contextlib
+import hashlib
+import os
+import struct
+import numpy as np
+import soundfile as sf
+import soxr
+from experiments import trace
+
+# Decoded and resampled audio is cached here, keyed on the file contents and the requested format
+CACHE_DIR = os.environ.get('QUANTUM_MUSIC_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'quantum-music'))
+
+# File hashes already computed by this process, keyed on (path, size, mtime)
+_hashes = {}
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb'):
+    """Opens a temporary file next to path, renaming it to path once the block succeeds.
+
+    Concurrent readers, such as other workers sharing a cache, never see a partial file. The
+    directory is created if needed, and the temporary file is removed if the block raises.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_file = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary_file, mode) as f:
+            yield f
+        os.replace(temporary_file, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_file)
+
+def file_hash(path):
+    """SHA-1 of the file contents, computed once per file version for the life of the process."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+def wav_memmap(path):
+    """Memory-maps the samples of an integer or float WAV file as a (frames, channels) array.
+
+    Returns (samples, samplerate). Raises ValueError for files that aren't plain RIFF/WAVE or use a
+    sample format NumPy can't map directly (e.g. 24-bit PCM).
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f'{path} is not a RIFF/WAVE file')
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{path} has no data chunk')
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                offset = f.tell()
+                break
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                f.seek(size % 2, os.SEEK_CUR)
+            else:
+                # Chunks are padded to an even number of bytes
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+    if fmt is None:
+        raise ValueError(f'{path} has no fmt chunk')
+    format_tag, channels, samplerate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if format_tag == 0xFFFE:
+        # WAVE_FORMAT_EXTENSIBLE keeps the real format tag at the start of the sub-format GUID
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+
+    dtypes = {(1, 8): 'u1', (1, 16): '<i2', (1, 32): '<i4', (3, 32): '<f4', (3, 64): '<f8'}
+    if (format_tag, bits) not in dtypes:
+        raise ValueError(f'{path} uses {bits}-bit samples with format {format_tag}, which cannot be memory-mapped')
+
+    # Streaming writers may leave the data size unset, so never map past the end of the file
+    size = min(size, os.path.getsize(path) - offset)
+    frames = size // block_align
+    return np.memmap(path, dtype=dtypes[format_tag, bits], mode='r', offset=offset, shape=(frames, channels)), samplerate
+
+def wav_peak(path):
+    """Largest absolute sample recorded in a float WAV file's PEAK chunk, or None if it has none.
+
+    Writers such as libsndfile keep a running peak while writing float files and store it in this
+    chunk when the file is closed, so the peak is known without reading the samples.
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            return None
+
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'PEAK':
+                # Version and timestamp, then a (value, position) pair per channel
+                peaks = np.frombuffer(f.read(size), dtype=[('value', '<f4'), ('position', '<u4')], offset=8)
+                return float(np.max(np.abs(peaks['value'])))
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+def resample(y, orig_sr, target_sr):
+    """Resamples along the last axis, matching librosa.resample(res_type='soxr_hq')."""
+    n_samples = int(np.ceil(y.shape[-1] * float(target_sr) / orig_sr))
+    y_hat = soxr.resample(y.T, orig_sr, target_sr, quality='soxr_hq').T
+
+    # Trim or zero-pad to the exact expected length
+    if y_hat.shape[-1] > n_samples:
+        y_hat = y_hat[..., :n_samples]
+    elif y_hat.shape[-1] < n_samples:
+        y_hat = np.pad(y_hat, [(0, 0)] * (y_hat.ndim - 1) + [(0, n_samples - y_hat.shape[-1])])
+    return np.asarray(y_hat, dtype=y.dtype)
+
+def decode(path, sr=None, mono=True, dtype=np.float32):
+    """Decodes path with soundfile, then downmixes and resamples it, without any caching."""
+    with trace.span('decode', file=path):
+        y, file_sr = sf.read(path, dtype=dtype, always_2d=True)
+
+        if not mono:
+            y = y.T
+        elif y.shape[1] == 1:
+            # A mono file needs no downmix: its only column is a view of the decoded buffer
+            y = y[:, 0]
+        else:
+            y = np.mean(y, axis=1)
+
+    if sr is not None and sr != file_sr:
+        with trace.span('resample', file=path, sr=sr):
+            y = resample(y, file_sr, sr)
+    return y
+
+def read_blocks(path, blocksize=65536, sr=None, mono=True, dtype=np.float32):
+    """Yields the file in blocks of about blocksize frames, resampled to sr (None keeps its rate) on the fly.
+
+    Blocks are (frames,) if mono, else (frames, channels) as soundfile reads them, and together hold
+    exactly as many frames as load_audio would return, so memory stays bounded for any file length.
+    """
+    with sf.SoundFile(path) as infile:
+        target_sr = infile.samplerate if sr is None else sr
+        channels = 1 if mono else infile.channels
+        empty = np.zeros(0 if mono else (0, channels), dtype=dtype)
+
+        # Same length librosa.resample trims or pads its output to
+        remaining = int(np.ceil(infile.frames * target_sr / infile.samplerate))
+
+        resampler = None
+        if infile.samplerate != target_sr:
+            resampler = soxr.ResampleStream(infile.samplerate, target_sr, channels, dtype=np.dtype(dtype).name, quality='HQ')
+
+        for block in infile.blocks(blocksize, dtype=np.dtype(dtype).name, always_2d=True):
+            if mono:
+                block = np.mean(block, axis=1)
+            if resampler is not None:
+                block = resampler.resample_chunk(block)
+            block = block[:remaining]
+            remaining -= len(block)
+            yield block
+
+        if resampler is not None:
+            block = resampler.resample_chunk(empty, last=True)[:remaining]
+            remaining -= len(block)
+            yield block
+        if remaining > 0:
+            yield np.zeros((remaining,) + empty.shape[1:], dtype=dtype)
+
+def peak(path, sr=None, blocksize=65536, cache=True):
+    """Largest absolute sample over all channels of the file at rate sr, found in one streaming pass.
+
+    Peaks are cached in CACHE_DIR next to resampled audio, keyed on the file's hash and the rate,
+    so normalizing the same file again doesn't decode it again.
+    """
+    info = sf.info(path)
+    if sr is None:
+        sr = info.samplerate
+
+    # Float WAV files may already record their peak in their header
+    if info.format == 'WAV' and sr == info.samplerate:
+        result = wav_peak(path)
+        if result is not None:
+            return result
+
+    cache_file = os.path.join(CACHE_DIR, f'{file_hash(path)}_{sr}_peak.txt') if cache else None
+    if cache and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return float(f.read())
+
+    result = 0.0
+    for block in read_blocks(path, blocksize, sr, mono=False):
+        if len(block):
+            result = max(result, float(np.max(np.abs(block))))
+
+    if cache:
+        with atomic_write(cache_file, 'w') as f:
+            f.write(repr(result))
+    return result
+
+def load_audio(path, sr=44100, mono=True, dtype=np.float32, mmap=False, cache=True):
+    """Loads an audio file as (y, sr) like librosa.load: y is (samples,) if mono, else (channels, samples).
+
+    sr=None keeps the file's own rate. With mmap, WAV files whose rate, channel layout and sample type
+    already match are memory-mapped instead of read, and cached results are mapped copy-on-write.
+    With cache, anything that had to be resampled or decoded from a compressed format is stored in
+    CACHE_DIR, keyed on the file's hash and the requested rate, channel layout and dtype, so repeated
+    runs over the same corpus skip decoding and resampling.
+    """
+    info = sf.info(path)
+    target_sr = info.samplerate if sr is None else sr
+
+    if mmap and info.format == 'WAV' and target_sr == info.samplerate:
+        try:
+            samples, _ = wav_memmap(path)
+        except ValueError:
+            samples = None
+        if samples is not None and samples.dtype == np.dtype(dtype):
+            if not mono:
+                return samples.T, target_sr
+            if samples.shape[1] == 1:
+                return samples[:, 0], target_sr
+
+    if not cache or (info.format == 'WAV' and target_sr == info.samplerate):
+        return decode(path, target_sr, mono, dtype), target_sr
+
+    layout = 'mono' if mono else 'multichannel'
+    cache_file = os.path.join(CACHE_DIR, f'{file_hash(path)}_{target_sr}_{layout}_{np.dtype(dtype).name}.npy')
+    if os.path.exists(cache_file):
+        with trace.span('decode', file=path, cached=True):
+            return np.load(cache_file, mmap_mode='c' if mmap else None), target_sr
+
+    y = decode(path, target_sr, mono, dtype)
+
+    with atomic_write(cache_file) as f:
+        np.save(f, y)
+    return y, target_sr
@@ -0,0 +1,142 @@
+import argparse
+import glob
+import importlib
+import importlib.util
+import multiprocessing
+import os
+import time
+import traceback
+
+def run_stft(module, input_file, stem):
+    module.process_audio_streaming(input_file, f'{stem}.wav', mono=mono)
+
+def run_fft(module, input_file, stem):
+    module.process_audio(input_file, f'{stem}.wav', spectrogram_file=f'{stem}.png', mono=mono)
+
+def run_multi_fft(module, input_file, stem):
+    # Already inside a pool worker, which can't start a pool of its own
+    module.process_audio(input_file, f'{stem}.wav', workers=1, mono=mono)
+
+def run_spectrogram(module, input_file, stem):
+    module.process_audio(input_file, output_file=f'{stem}.wav', spectrogram_file=f'{stem}.png', mono=mono)
+
+def run_stft_quantum(module, input_file, stem):
+    module.process_audio(input_file, f'{stem}.wav', mono=mono)
+
+def run_quantum_chunk(module, input_file, stem):
+    module.process_audio(input_file, f'{stem}.wav', workers=1, backend='numpy', archive_file=f'{stem}_circuits.qca',
+                         spectrogram_files=(f'{stem}_input_spectrogram.png', f'{stem}_output_spectrogram.png'), mono=mono)
+
+# Pipeline name: (module, function running it on one file, suffix of the output it writes last).
+# A file counts as done when that output is newer than both the input and the module's source
+PIPELINES = {
+    'stft': ('experiments.stft.stft', run_stft, '.wav'),
+    'fft': ('experiments.fft.fft', run_fft, '.png'),
+    'multi-fft': ('experiments.multi_fft.multi_fft', run_multi_fft, '_report.json'),
+    'spectrogram': ('experiments.spectrogram.spectrogram', run_spectrogram, '.wav'),
+    'stft-quantum': ('experiments.quantum.stft_quantum', run_stft_quantum, '.wav'),
+    'quantum-chunk': ('experiments.quantum.script', run_quantum_chunk, '_output_spectrogram.png'),
+}
+
+def find_inputs(input_path, pattern='*.wav'):
+    """Input files and the directory their output paths are relative to.
+
+    A directory is searched recursively for pattern; anything else is treated as a glob itself.
+    """
+    if os.path.isdir(input_path):
+        files = glob.glob(os.path.join(input_path, '**', pattern), recursive=True)
+        root = input_path
+    else:
+        files = glob.glob(input_path, recursive=True)
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files]) if files else '.'
+    return sorted(os.path.abspath(f) for f in files if os.path.isfile(f)), os.path.abspath(root)
+
+def output_stem(input_file, root, output_dir):
+    """Output path of an input without its extension, mirroring its place under root."""
+    return os.path.join(output_dir, os.path.splitext(os.path.relpath(input_file, root))[0])
+
+def is_up_to_date(input_file, stem, pipeline):
+    module_name, _, marker_suffix = PIPELINES[pipeline]
+    marker = stem + marker_suffix
+    if not os.path.exists(marker):
+        return False
+    source = importlib.util.find_spec(module_name).origin
+    return os.path.getmtime(marker) >= max(os.path.getmtime(input_file), os.path.getmtime(source))
+
+# The pipeline module, imported once per worker so every file after the first runs warm, and whether it downmixes
+module = None
+pipeline_name = None
+mono = True
+
+def init_worker(pipeline, multichannel=False):
+    global module, pipeline_name, mono
+    pipeline_name = pipeline
+    mono = not multichannel
+    module = importlib.import_module(PIPELINES[pipeline][0])
+
+def run_file(args):
+    """Runs the pipeline on one file, returning (input_file, seconds, error traceback or None)."""
+    input_file, stem = args
+    _, run, marker_suffix = PIPELINES[pipeline_name]
+    os.makedirs(os.path.dirname(stem) or '.', exist_ok=True)
+
+    start = time.perf_counter()
+    try:
+        run(module, input_file, stem)
+    except Exception:
+        # Don't leave a half-written marker that would make the file look done next time
+        if os.path.exists(stem + marker_suffix):
+            os.remove(stem + marker_suffix)
+        return input_file, time.perf_counter() - start, traceback.format_exc()
+    return input_file, time.perf_counter() - start, None
+
+def run_batch(input_path, pipeline, output_dir, workers=None, pattern='*.wav', force=False, multichannel=False):
+    """Runs a pipeline over every matching file across a pool of warm workers, returning the failed files.
+
+    Files whose outputs are up to date are skipped unless force is set, and a failing file is
+    reported without stopping the rest. multichannel keeps every channel instead of downmixing.
+    """
+    input_files, root = find_inputs(input_path, pattern)
+    jobs = []
+    for input_file in input_files:
+        stem = output_stem(input_file, root, output_dir)
+        if force or not is_up_to_date(input_file, stem, pipeline):
+            jobs.append((input_file, stem))
+    print(f'{len(jobs)} of {len(input_files)} files to run through {pipeline}')
+
+    failed = []
+    if not jobs:
+        return failed
+
+    def collect(results):
+        for done, (input_file, seconds, error) in enumerate(results, 1):
+            if error is None:
+                print(f'[{done}/{len(jobs)}] {input_file} ({seconds:.1f}s)')
+            else:
+                failed.append(input_file)
+                print(f'[{done}/{len(jobs)}] {input_file} FAILED\n{error}')
+
+    if workers == 1:
+        init_worker(pipeline, multichannel)
+        collect(map(run_file, jobs))
+    else:
+        with multiprocessing.Pool(min(workers or os.cpu_count(), len(jobs)), initializer=init_worker, initargs=(pipeline, multichannel)) as pool:
+            collect(pool.imap_unordered(run_file, jobs))
+
+    print(f'{len(jobs) - len(failed)} succeeded, {len(failed)} failed')
+    return failed
+
+# Command-line arguments parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one of the experiments over a directory or glob of audio files.")
+    parser.add_argument('pipeline', type=str, choices=list(PIPELINES), help='Experiment to run on every file')
+    parser.add_argument('--input', type=str, required=True, help='Input directory (searched recursively) or glob')
+    parser.add_argument('--output', type=str, required=True, help='Output directory, mirroring the layout of the input directory')
+    parser.add_argument('--pattern', type=str, default='*.wav', help='File pattern to search input directories for')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='Rerun files whose outputs are already up to date')
+    parser.add_argument('--multichannel', action='store_true', help='Keep every channel instead of downmixing to mono')
+    args = parser.parse_args()
+
+    failed = run_batch(args.input, args.pipeline, args.output, args.workers, args.pattern, args.force, args.multichannel)
+    raise SystemExit(1 if failed else 0)
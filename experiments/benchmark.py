@@ -0,0 +1,223 @@
+import argparse
+import faulthandler
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+import traceback
+import numpy as np
+import soundfile as sf
+
+# Synthetic input lengths in seconds
+LENGTHS = {'1s': 1, '60s': 60, '10min': 600}
+
+SAMPLE_RATE = 44100
+
+# Every 16-sample chunk the quantum chunk loop simulates comes back as a 65536-sample state, so it
+# only runs on the start of each input
+QUANTUM_SECONDS = 0.05
+
+# Length of the input each case runs on once, untimed, before the measured run
+WARM_UP_SECONDS = 0.1
+
+def run_stft(module, input_file, output_dir, seconds):
+    module.process_audio(input_file, os.path.join(output_dir, 'stft.wav'))
+    return seconds
+
+def run_fft(module, input_file, output_dir, seconds):
+    module.process_audio(input_file, os.path.join(output_dir, 'fft.wav'), spectrogram_file=os.path.join(output_dir, 'fft.png'))
+    return seconds
+
+def run_multi_fft(module, input_file, output_dir, seconds):
+    module.process_audio(input_file, os.path.join(output_dir, 'multi_fft.wav'))
+    return seconds
+
+def run_spectrogram(module, input_file, output_dir, seconds):
+    module.process_audio(input_file, output_file=os.path.join(output_dir, 'spectrogram.wav'),
+                         spectrogram_file=os.path.join(output_dir, 'spectrogram.png'))
+    return seconds
+
+def run_quantum_chunk(module, input_file, output_dir, seconds):
+    seconds = min(seconds, QUANTUM_SECONDS)
+    module.process_audio(input_file, os.path.join(output_dir, 'quantum.wav'), max_samples=int(seconds * SAMPLE_RATE),
+                         backend='numpy', archive_file=os.path.join(output_dir, 'circuits.qca'),
+                         spectrogram_files=(os.path.join(output_dir, 'input.png'), os.path.join(output_dir, 'output.png')))
+    return seconds
+
+def run_interpolate(module, input_file, output_dir, seconds):
+    module.mix_audio_files(input_file, input_file.replace('_a.wav', '_b.wav'), os.path.join(output_dir, 'mixed.wav'), 50)
+    return seconds
+
+# Case name: (module, function running it and returning the seconds of audio it processed)
+CASES = {
+    'stft': ('experiments.stft.stft', run_stft),
+    'fft': ('experiments.fft.fft', run_fft),
+    'multi-fft': ('experiments.multi_fft.multi_fft', run_multi_fft),
+    'spectrogram': ('experiments.spectrogram.spectrogram', run_spectrogram),
+    'quantum-chunk': ('experiments.quantum.script', run_quantum_chunk),
+    'interpolate': ('experiments.interpolation.interpolate', run_interpolate),
+}
+
+def synthetic_signal(seconds, seed=0, sr=SAMPLE_RATE):
+    """A reproducible test signal: a slow sine sweep, a kick every half second and a little noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+
+    # Sweep from 55Hz to 7kHz and back every 10 seconds
+    frequency = 55 * 2 ** (7 * (1 - np.abs((t % 10) / 5 - 1)))
+    y = 0.3 * np.sin(2 * np.pi * np.cumsum(frequency) / sr)
+
+    # Decaying 60Hz kicks
+    since_kick = t % 0.5
+    y += 0.5 * np.sin(2 * np.pi * 60 * since_kick) * np.exp(-since_kick * 20)
+
+    y += 0.05 * rng.standard_normal(len(t))
+    return (y / np.max(np.abs(y))).astype(np.float32)
+
+def write_input(path, seconds):
+    """Writes a synthetic input to path, which ends in _a.wav, and its _b.wav partner for the mixer."""
+    sf.write(path, synthetic_signal(seconds, seed=0), SAMPLE_RATE, subtype='PCM_16')
+    sf.write(path.replace('_a.wav', '_b.wav'), synthetic_signal(seconds, seed=1), SAMPLE_RATE, subtype='PCM_16')
+
+def write_inputs(directory, lengths):
+    """Writes two synthetic inputs (a and b, for the mixer) per length, returning {length: path of input a}."""
+    inputs = {}
+    for length in lengths:
+        inputs[length] = os.path.join(directory, f'{length}_a.wav')
+        write_input(inputs[length], LENGTHS[length])
+    return inputs
+
+def measure_case(connection, case, input_file, output_dir, seconds):
+    """Runs one case in this (fresh) process and sends back its timing and peak memory.
+
+    The case first runs once on a short input, untimed, so that deferred imports and numba's
+    compilation on first call aren't part of the measurement.
+    """
+    # Print a traceback even if the process crashes outright
+    faulthandler.enable()
+    module_name, run = CASES[case]
+    result = {}
+    try:
+        module = importlib.import_module(module_name)
+        warm_up_dir = os.path.join(output_dir, 'warm_up')
+        os.makedirs(warm_up_dir, exist_ok=True)
+        warm_up_file = os.path.join(warm_up_dir, 'warm_up_a.wav')
+        write_input(warm_up_file, WARM_UP_SECONDS)
+        run(module, warm_up_file, warm_up_dir, WARM_UP_SECONDS)
+
+        start = time.perf_counter()
+        audio_seconds = run(module, input_file, output_dir, seconds)
+        result['wall_seconds'] = time.perf_counter() - start
+        result['audio_seconds'] = audio_seconds
+        result['realtime_factor'] = audio_seconds / result['wall_seconds']
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    # ru_maxrss is in kilobytes on Linux; worker pools started by the case count as children
+    result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result['peak_children_rss_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    connection.send(result)
+    connection.close()
+
+def run_benchmarks(cases=tuple(CASES), lengths=tuple(LENGTHS), repeat=1, work_dir=None):
+    """Times every case on every input length, each run in its own process so peak RSS is its own.
+
+    The fastest of repeat runs is kept, with the largest peak RSS seen. realtime_factor is seconds
+    of audio processed per second of wall time, so above 1 is faster than real time.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        inputs = write_inputs(directory, lengths)
+        for length in lengths:
+            for case in cases:
+                best = None
+                peak = 0
+                for _ in range(repeat):
+                    output_dir = os.path.join(directory, case, length)
+                    os.makedirs(output_dir, exist_ok=True)
+
+                    receiver, sender = multiprocessing.Pipe(duplex=False)
+                    process = multiprocessing.Process(target=measure_case, args=(sender, case, inputs[length], output_dir, LENGTHS[length]))
+                    process.start()
+                    sender.close()
+                    try:
+                        result = receiver.recv()
+                    except EOFError:
+                        result = {'peak_rss_bytes': 0}
+                    process.join()
+                    if process.exitcode:
+                        # Keep the traceback the case sent back, if it got that far
+                        result['error'] = result.get('error', '') + f'Benchmark process died with exit code {process.exitcode}'
+
+                    peak = max(peak, result['peak_rss_bytes'])
+                    if best is None or 'error' in result or result['wall_seconds'] < best['wall_seconds']:
+                        best = result
+                    if 'error' in result:
+                        break
+
+                best = dict(best, case=case, length=length, peak_rss_bytes=peak)
+                results.append(best)
+                if 'error' in best:
+                    print(f'{case:14} {length:6} FAILED\n{best["error"]}')
+                else:
+                    print(f'{case:14} {length:6} {best["wall_seconds"]:9.2f}s {best["peak_rss_bytes"] / 2 ** 20:8.0f} MiB '
+                          f'{best["realtime_factor"]:9.1f}x realtime')
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+
+def compare_results(baseline, current, threshold=0.1):
+    """Rows of (case, length, wall time ratio, peak RSS ratio, verdict) for the runs both results share.
+
+    Ratios are current over baseline; a change beyond threshold is called an improvement or a regression.
+    """
+    previous = {(result['case'], result['length']): result for result in baseline['results'] if 'error' not in result}
+    rows = []
+    for result in current['results']:
+        old = previous.get((result['case'], result['length']))
+        if old is None or 'error' in result:
+            continue
+        time_ratio = result['wall_seconds'] / old['wall_seconds']
+        memory_ratio = result['peak_rss_bytes'] / old['peak_rss_bytes']
+        if time_ratio > 1 + threshold or memory_ratio > 1 + threshold:
+            verdict = 'regression'
+        elif time_ratio < 1 - threshold or memory_ratio < 1 - threshold:
+            verdict = 'improvement'
+        else:
+            verdict = ''
+        rows.append((result['case'], result['length'], time_ratio, memory_ratio, verdict))
+    return rows
+
+def print_comparison(rows):
+    print(f'{"case":14} {"length":6} {"time":>8} {"memory":>8}')
+    for case, length, time_ratio, memory_ratio, verdict in rows:
+        print(f'{case:14} {length:6} {time_ratio:7.2f}x {memory_ratio:7.2f}x {verdict}')
+
+# Command-line arguments parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the experiments on synthetic inputs of several lengths.")
+    parser.add_argument('--cases', type=str, nargs='+', default=list(CASES), choices=list(CASES), help='Pipelines to benchmark')
+    parser.add_argument('--lengths', type=str, nargs='+', default=list(LENGTHS), choices=list(LENGTHS), help='Input lengths to benchmark')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, keeping the fastest')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='Path to write the JSON results to')
+    parser.add_argument('--compare', type=str, default=None, help='Earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change counted as a regression or improvement')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cases, args.lengths, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(compare_results(json.load(f), results, args.threshold))
@@ -0,0 +1,179 @@
+import functools
+import numpy as np
+
+# The effects in stft.py, fft.py and quantum/stft_quantum.py split a spectrum into amplitude and
+# unwrapped phase, take their derivatives along the last axis, then integrate them back. Doing that
+# with plain NumPy expressions makes about ten full-size temporaries per spectrum; here every step
+# writes into preallocated buffers instead.
+#
+# The running state carries everything one block needs from the one before it, so a long spectrum can
+# be processed block by block with the same result as all at once. Without a state the first column is
+# its own predecessor, so its derivatives are zero, and the sums start from zero. The scratch buffers
+# live in the state too, so a stream of same-sized blocks allocates them once and they are freed with it.
+
+class State:
+    """Running state of the round trip of a spectrum, carried from each block to the next.
+
+    previous_amplitude, previous_phase and previous_unwrapped hold the previous block's last column,
+    correction the running correction of the phase unwrapping, and amplitude_sum and phase_sum the
+    integrals so far, all with one entry per row. scratch holds the buffers blocks of one shape reuse.
+    """
+
+    def __init__(self, spectrum, dtype=np.float64):
+        # The first column is its own predecessor
+        first = spectrum[:, 0]
+        self.previous_amplitude = np.abs(first)
+        self.previous_phase = np.angle(first)
+        self.previous_unwrapped = self.previous_phase.copy()
+        self.correction = np.zeros_like(self.previous_phase)
+        self.amplitude_sum = np.zeros(len(first), dtype=dtype)
+        self.phase_sum = np.zeros(len(first), dtype=dtype)
+        self.scratch = None
+
+def _scratch(state, shape, dtype, count):
+    """count scratch buffers of the given shape, reused from the state while blocks keep that shape."""
+    if state.scratch is None or len(state.scratch) < count or state.scratch[0].shape != shape:
+        state.scratch = [np.empty(shape, dtype=dtype) for _ in range(count)]
+    return state.scratch
+
+def _differences_numpy(amplitude, phase, dt, state, amplitude_derivative, phase_derivative):
+    previous_amplitude = state.previous_amplitude
+    previous_phase = state.previous_phase
+    previous_unwrapped = state.previous_unwrapped
+    correction = state.correction
+    step, step_mod = _scratch(state, amplitude.shape, amplitude.dtype, 4)[2:]
+
+    # Amplitude derivative, the first column against the previous block's last
+    np.subtract(amplitude[:, 1:], amplitude[:, :-1], out=amplitude_derivative[:, 1:])
+    np.subtract(amplitude[:, 0], previous_amplitude, out=amplitude_derivative[:, 0])
+    amplitude_derivative /= dt
+    previous_amplitude[:] = amplitude[:, -1]
+
+    # Unwrap the phase exactly as np.unwrap does, continuing its running correction
+    np.subtract(phase[:, 1:], phase[:, :-1], out=step[:, 1:])
+    np.subtract(phase[:, 0], previous_phase, out=step[:, 0])
+    previous_phase[:] = phase[:, -1]
+
+    np.add(step, np.pi, out=step_mod)
+    np.mod(step_mod, 2 * np.pi, out=step_mod)
+    step_mod -= np.pi
+    np.copyto(step_mod, np.pi, where=(step_mod == -np.pi) & (step > 0))
+
+    phase_correction = step_mod
+    np.subtract(step_mod, step, out=phase_correction)
+    np.copyto(phase_correction, 0, where=np.abs(step, out=step) < np.pi)
+    phase_correction[:, 0] += correction
+    np.cumsum(phase_correction, axis=1, out=phase_correction)
+    correction[:] = phase_correction[:, -1]
+    unwrapped = phase
+    unwrapped += phase_correction
+
+    # Phase derivative
+    np.subtract(unwrapped[:, 1:], unwrapped[:, :-1], out=phase_derivative[:, 1:])
+    np.subtract(unwrapped[:, 0], previous_unwrapped, out=phase_derivative[:, 0])
+    phase_derivative /= dt
+    previous_unwrapped[:] = unwrapped[:, -1]
+
+@functools.lru_cache(maxsize=None)
+def _numba_differences():
+    """The unwrapping and differences compiled with numba into one pass, or None without numba."""
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    @numba.njit(cache=True)
+    def differences(amplitude, phase, dt, pi, previous_amplitude, previous_phase, previous_unwrapped, correction,
+                    amplitude_derivative, phase_derivative):
+        # Constants typed like the amplitudes, so float32 spectra are unwrapped in float32 like NumPy does
+        two_pi = pi + pi
+        zero = pi - pi
+        for row in range(amplitude.shape[0]):
+            last_amplitude = previous_amplitude[row]
+            last_phase = previous_phase[row]
+            last_unwrapped = previous_unwrapped[row]
+            running_correction = correction[row]
+            for column in range(amplitude.shape[1]):
+                # One step of np.unwrap
+                step = phase[row, column] - last_phase
+                step_mod = (step + pi) % two_pi - pi
+                if step_mod == -pi and step > 0:
+                    step_mod = pi
+                phase_correction = step_mod - step
+                if abs(step) < pi:
+                    phase_correction = zero
+                running_correction = running_correction + phase_correction
+                unwrapped = phase[row, column] + running_correction
+
+                amplitude_derivative[row, column] = (amplitude[row, column] - last_amplitude) / dt
+                phase_derivative[row, column] = (unwrapped - last_unwrapped) / dt
+                last_amplitude = amplitude[row, column]
+                last_phase = phase[row, column]
+                last_unwrapped = unwrapped
+
+            previous_amplitude[row] = last_amplitude
+            previous_phase[row] = last_phase
+            previous_unwrapped[row] = last_unwrapped
+            correction[row] = running_correction
+
+    return differences
+
+def decompose(spectrum, dt=1.0, state=None, out=None, backend=None):
+    """Amplitude and unwrapped phase derivatives of a (rows, columns) spectrum along its columns.
+
+    Derivatives are differences divided by dt, in the precision the spectrum's real part and dt
+    promote to. out is an optional pair of buffers for them, shaped like the spectrum. state (see
+    State) is updated in place so the next block continues from this one. backend is 'numba',
+    'numpy' or None for numba when it is installed; both give bit-identical results, numba in one
+    pass with two scratch buffers instead of four. Returns (amplitude_derivative, phase_derivative, state).
+    """
+    dtype = np.result_type(spectrum.real.dtype, dt)
+    dt = dtype.type(dt)
+    if state is None:
+        state = State(spectrum, dtype)
+    if out is None:
+        out = np.empty(spectrum.shape, dtype=dtype), np.empty(spectrum.shape, dtype=dtype)
+    amplitude_derivative, phase_derivative = out
+
+    kernel = None if backend == 'numpy' else _numba_differences()
+    if kernel is None and backend == 'numba':
+        raise ImportError('numba is not installed')
+
+    # Amplitude and phase through NumPy's own ufuncs, whose rounding both backends then share
+    amplitude, phase = _scratch(state, spectrum.shape, spectrum.real.dtype, 2 if kernel else 4)[:2]
+    np.abs(spectrum, out=amplitude)
+    np.arctan2(spectrum.imag, spectrum.real, out=phase)
+
+    if kernel is None:
+        _differences_numpy(amplitude, phase, dt, state, amplitude_derivative, phase_derivative)
+    else:
+        kernel(amplitude, phase, dt, amplitude.dtype.type(np.pi), state.previous_amplitude, state.previous_phase, state.previous_unwrapped,
+               state.correction, amplitude_derivative, phase_derivative)
+    return amplitude_derivative, phase_derivative, state
+
+def integrate(derivative, running_sum):
+    """Integrates a derivative back in place along its columns, starting from running_sum and updating it."""
+    derivative[:, 0] += running_sum
+    np.cumsum(derivative, axis=1, out=derivative)
+    running_sum[:] = derivative[:, -1]
+    return derivative
+
+def combine(amplitude, phase, out=None):
+    """amplitude * exp(1j * phase), computed into out (a complex buffer shaped like them)."""
+    if out is None:
+        out = np.empty(amplitude.shape, dtype=np.result_type(amplitude.dtype, np.complex64))
+    np.multiply(phase, 1j, out=out)
+    np.exp(out, out=out)
+    out *= amplitude
+    return out
+
+def reconstruct(amplitude_derivative, phase_derivative, state, out=None):
+    """Integrates both derivatives back in place and combines them into a spectrum. Returns (spectrum, state)."""
+    integrate(amplitude_derivative, state.amplitude_sum)
+    integrate(phase_derivative, state.phase_sum)
+    return combine(amplitude_derivative, phase_derivative, out), state
+
+def round_trip(spectrum, dt=1.0, state=None, out=None, backend=None):
+    """Rebuilds a spectrum from its amplitude and phase derivatives, as the effects do. Returns (spectrum, state)."""
+    amplitude_derivative, phase_derivative, state = decompose(spectrum, dt, state, backend=backend)
+    return reconstruct(amplitude_derivative, phase_derivative, state, out)
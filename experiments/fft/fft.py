@@ -1,19 +1,14 @@
 import numpy as np
 import librosa
 import soundfile as sf
-import matplotlib.pyplot as plt
-from pydub import AudioSegment
+from experiments import derivative, trace
+from experiments.audio_io import load_audio
+from experiments.render import PREVIEW_WIDTH, render_spectrogram
 
-def process_audio(input_file, output_file, mix=100):
-    # Load audio file and convert to mono
-    y, sr = librosa.load(input_file, sr=None, mono=True)
+def fft_effect_reference(y, mix=100):
+    """The original complex-FFT version of fft_effect, kept to check the rfft path against."""
     original_y = np.copy(y)
 
-    # Resample to 44.1kHz if necessary
-    if sr != 44100:
-        y = librosa.resample(y, orig_sr=sr, target_sr=44100)
-        sr = 44100
-
     # Compute FFT
     fft = np.fft.fft(y)
 
@@ -48,22 +43,91 @@ def process_audio(input_file, output_file, mix=100):
     mixed_y = original_y * mix_a + np.real(y_reconstructed) * mix_b
 
     # Normalize audio signals
-    mixed_y = librosa.util.normalize(mixed_y)
+    return librosa.util.normalize(mixed_y)
+
+def fft_effect(y, mix=100, dtype=np.float64):
+    """Rebuilds the spectrum of y from its amplitude and phase derivatives and mixes the result with y.
+
+    The signal is real, so only the rfft half of the spectrum is processed; the negative frequencies
+    the complex version computed are its mirror image. dtype=np.float32 runs everything in
+    float32/complex64, halving memory again at the cost of precision in the running sums.
+
+    y may be (channels, samples): every channel is transformed in the same call and the result is
+    normalized to the loudest channel, keeping the balance between them.
+    """
+    y = y.astype(dtype, copy=False)
+
+    # Compute the FFT of the real signal, a row per channel
+    with trace.span('transform'):
+        fft = np.fft.rfft(y)
+        fft = fft.reshape(-1, fft.shape[-1])
+
+    # Rebuild it from the derivatives of its amplitude and phase, writing the result over the spectrum
+    with trace.span('derivative'):
+        derivative.round_trip(fft, out=fft)
+
+    # Compute the inverse FFT at the input's length
+    with trace.span('inverse'):
+        mixed_y = np.fft.irfft(fft, n=y.shape[-1]).reshape(y.shape)
+    del fft
+
+    with trace.span('normalize'):
+        # Mix original and FFT-processed audio
+        mix_b = mix / 100.0
+        mix_a = 1.0 - mix_b
+        mixed_y *= mix_b
+        if mix_a:
+            mixed_y += y * mix_a
+
+        # Normalize audio signals, all channels together
+        return librosa.util.normalize(mixed_y, axis=None)
+
+def check_against_reference(input_file, mix=100, dtype=np.float64, rtol=None):
+    """Checks fft_effect against the original complex-FFT version, returning both versions' max error.
+
+    In exact arithmetic the derivative round trip only subtracts the DC bin's amplitude and phase
+    from every bin, so both versions are measured against that closed form, relative to its peak.
+    The reference's running sums span the whole complex spectrum and drift on long inputs (about 1%
+    after ten minutes), so the rfft path passes if its error is within rtol (1e-9 for float64, 1e-2
+    for float32) or no worse than the reference's. Raises AssertionError otherwise.
+    """
+    if rtol is None:
+        rtol = 1e-9 if np.dtype(dtype) == np.float64 else 1e-2
+
+    y, sr = load_audio(input_file, sr=44100)
+    reference = fft_effect_reference(y, mix)
+    actual = fft_effect(y, mix, dtype)
+    if len(actual) != len(reference):
+        raise AssertionError(f'rfft path produced {len(actual)} samples, reference produced {len(reference)}')
+
+    # The closed form of the effect
+    spectrum = np.fft.rfft(y.astype(np.float64))
+    spectrum = (np.abs(spectrum) - np.abs(spectrum[0])) * np.exp(1j * (np.angle(spectrum) - np.angle(spectrum[0])))
+    mix_b = mix / 100.0
+    expected = librosa.util.normalize(y * (1.0 - mix_b) + np.fft.irfft(spectrum, n=len(y)) * mix_b)
+
+    peak = np.max(np.abs(expected))
+    error = np.max(np.abs(actual - expected)) / peak
+    reference_error = np.max(np.abs(reference - expected)) / peak
+    if error > max(rtol, reference_error):
+        raise AssertionError(f'rfft path is off by {error:.3g}, the reference by {reference_error:.3g} (rtol {rtol:.3g})')
+    return float(error), float(reference_error)
+
+def process_audio(input_file, output_file, mix=100, dtype=np.float64, spectrogram_file="fft.png", mono=True):
+    with trace.span('fft.process_audio', file=input_file):
+        # Load audio at 44.1kHz
+        y, sr = load_audio(input_file, sr=44100, mono=mono)
 
-    # Write to output file
-    sf.write(output_file, mixed_y, sr)
+        mixed_y = fft_effect(y, mix, dtype)
 
-    # Generate spectrogram images
-    orig_spectrogram = np.abs(librosa.stft(original_y))
+        # Write to output file, one column per channel
+        with trace.span('write'):
+            sf.write(output_file, mixed_y.T, sr)
 
-    plt.figure(figsize=(10, 10))
-    plt.specgram(original_y, NFFT=2048, Fs=2, Fc=0, noverlap=128, cmap='inferno', sides='default', mode='default', scale='dB');
-    plt.axis('off')
-    plt.gca().xaxis.set_major_locator(plt.NullLocator())
-    plt.gca().yaxis.set_major_locator(plt.NullLocator())
-    plt.margins(0,0)
-    plt.savefig("fft.png", bbox_inches='tight', pad_inches=0, format='png', dpi=300)
-    plt.close()
+        # Generate spectrogram image, unless it was turned off
+        if spectrogram_file is not None:
+            render_spectrogram(y, spectrogram_file, width=PREVIEW_WIDTH)
 
 # Test the function
-process_audio('wavs/input.wav', 'fft.wav', mix=100)
+if __name__ == "__main__":
+    process_audio('wavs/input.wav', 'fft.wav', mix=100)
@@ -1,66 +1,116 @@
-from pydub import AudioSegment
 import numpy as np
-from scipy.io.wavfile import write
+import soundfile as sf
 import argparse
+from experiments import trace
+from experiments.audio_io import peak, read_blocks
 
-def convert_to_stereo(audio):
-    if audio.channels == 2:
-        return audio
-    return audio.set_channels(2)
+def stereo_to_numpy(block):
+    # Mono blocks are broadcast to both channels without copying
+    if block.shape[1] == 1:
+        return np.broadcast_to(block, (len(block), 2))
+    return block[:, :2]
 
-def stereo_to_numpy(audio):
-    samples = np.array(audio.get_array_of_samples())
-    if audio.channels == 2:
-        return np.reshape(samples, (-1, 2))
-    else:
-        return np.repeat(samples[:, np.newaxis], 2, axis=1)
+def mix_curve(curve):
+    """Turns a mix curve into a function of time in seconds.
 
-def normalize_audio(data):
-    gain = 32767.0 / np.max(np.abs(data))
-    return data * gain
+    None means 1, a number is a constant weight, a list of (seconds, weight) breakpoints is
+    interpolated linearly (holding the first and last weights), and callables are used as they are.
+    """
+    if curve is None:
+        curve = 1.0
+    if callable(curve):
+        return curve
+    if np.isscalar(curve):
+        return lambda times: np.full(len(times), curve)
+    seconds, weights = np.asarray(curve, dtype=np.float64).T
+    return lambda times: np.interp(times, seconds, weights)
 
-def mix_audio_files(input_path_a="input_a.wav", input_path_b="input_b.wav", output_path="mixed.wav", mix_percentage=50):
-    # Read the audio files
-    audio1 = AudioSegment.from_wav(input_path_a)
-    audio2 = AudioSegment.from_wav(input_path_b)
+def parse_curve(text):
+    """Parses a curve given as a weight ('0.5') or as seconds:weight breakpoints ('0:1,30:0')."""
+    if ':' not in text:
+        return float(text)
+    return [tuple(float(value) for value in point.split(':')) for point in text.split(',')]
+
+def rechunk(blocks, blocksize):
+    """Regroups a stream of blocks into blocks of exactly blocksize frames, except for the last one."""
+    pending = None
+    for block in blocks:
+        pending = block if pending is None else np.concatenate([pending, block])
+        while len(pending) >= blocksize:
+            yield pending[:blocksize]
+            pending = pending[blocksize:]
+    if pending is not None and len(pending):
+        yield pending
+
+def mix_streams(input_paths, output_path="mixed.wav", gains=None, curves=None, frame_rate=None, blocksize=65536, normalize=True):
+    """Mixes any number of files into a stereo 16-bit file, streaming so memory stays bounded.
+
+    Every input is read at frame_rate (the highest input rate by default), normalized to its own peak
+    (cached per file, see audio_io.peak), scaled by its gain and its mix curve over time (see
+    mix_curve) and summed. The output is as long as the shortest input.
+    """
+    gains = [1.0] * len(input_paths) if gains is None else gains
+    curves = [None] * len(input_paths) if curves is None else curves
+    curves = [mix_curve(curve) for curve in curves]
 
-    # Convert to stereo if they are not already
-    audio1_stereo = convert_to_stereo(audio1)
-    audio2_stereo = convert_to_stereo(audio2)
+    # Read every file at the highest of their frame rates
+    if frame_rate is None:
+        frame_rate = max(sf.info(path).samplerate for path in input_paths)
 
-    # Make sure they have the same frame rate
-    if audio1_stereo.frame_rate != audio2_stereo.frame_rate:
-        frame_rate = max(audio1_stereo.frame_rate, audio2_stereo.frame_rate)
-        audio1_stereo = audio1_stereo.set_frame_rate(frame_rate)
-        audio2_stereo = audio2_stereo.set_frame_rate(frame_rate)
+    # First pass: each file's peak, so the mix can be normalized before it is read
+    if normalize:
+        with trace.span('peak'):
+            gains = [gain / (peak(path, frame_rate) or 1.0) for gain, path in zip(gains, input_paths)]
 
-    data1 = stereo_to_numpy(audio1_stereo)
-    data2 = stereo_to_numpy(audio2_stereo)
+    # Second pass: read all inputs in lockstep, in blocks of the same size
+    streams = [rechunk(read_blocks(path, blocksize, frame_rate, mono=False), blocksize) for path in input_paths]
+    mixed = np.empty((blocksize, 2), dtype=np.float32)
+    pcm = np.empty((blocksize, 2), dtype=np.int16)
+    position = 0
 
-    # Normalize audio data
-    data1 = normalize_audio(data1)
-    data2 = normalize_audio(data2)
+    with trace.span('mix', inputs=len(input_paths)), \
+            sf.SoundFile(output_path, 'w', samplerate=frame_rate, channels=2, subtype='PCM_16') as outfile:
+        for blocks in zip(*streams):
+            # The shortest input ends the mix
+            n = min(len(block) for block in blocks)
+            times = (position + np.arange(n)) / frame_rate
 
-    # Make sure they have the same length
-    min_length = min(len(data1), len(data2))
-    data1 = data1[:min_length]
-    data2 = data2[:min_length]
+            mixed[:n] = 0
+            for block, gain, curve in zip(blocks, gains, curves):
+                weights = (gain * curve(times)).astype(np.float32)
+                mixed[:n] += stereo_to_numpy(block[:n]) * weights[:, np.newaxis]
 
-    # Mix the audios
+            # Convert to 16-bit PCM, clipping rather than wrapping around
+            mixed[:n] *= 32767
+            np.clip(mixed[:n], -32768, 32767, out=mixed[:n])
+            np.copyto(pcm[:n], mixed[:n], casting='unsafe')
+            outfile.write(pcm[:n])
+            trace.count('blocks')
+
+            position += n
+            if n < blocksize:
+                break
+
+def mix_audio_files(input_path_a="input_a.wav", input_path_b="input_b.wav", output_path="mixed.wav", mix_percentage=50):
+    # Mix the two files at a fixed percentage of file b
     mix_b = mix_percentage / 100.0
     mix_a = 1.0 - mix_b
-    mixed = np.array(data1 * mix_a + data2 * mix_b, dtype=np.int16)
-
-    # Save the result
-    write(output_path, frame_rate, mixed)
+    mix_streams([input_path_a, input_path_b], output_path, curves=[mix_a, mix_b])
 
 # Command-line arguments parsing
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Mix two audio files.")
+    parser = argparse.ArgumentParser(description="Mix two or more audio files.")
     parser.add_argument('--inputa', type=str, default='input_a.wav', help='Path to input file a')
     parser.add_argument('--inputb', type=str, default='input_b.wav', help='Path to input file b')
     parser.add_argument('--output', type=str, default='mixed.wav', help='Path to output file')
     parser.add_argument('--mix_percentage', type=int, default=50, help='Mix percentage for file b (0-100)')
+    parser.add_argument('--inputs', type=str, nargs='+', help='Paths to any number of input files, instead of --inputa and --inputb')
+    parser.add_argument('--gains', type=float, nargs='+', help='Gain of each of --inputs')
+    parser.add_argument('--curves', type=parse_curve, nargs='+', help="Mix curve of each of --inputs, a weight or seconds:weight breakpoints like '0:1,30:0'")
+    parser.add_argument('--blocksize', type=int, default=65536, help='Frames mixed at a time')
     args = parser.parse_args()
 
-    mix_audio_files(args.inputa, args.inputb, args.output, args.mix_percentage)
+    if args.inputs:
+        mix_streams(args.inputs, args.output, args.gains, args.curves, blocksize=args.blocksize)
+    else:
+        mix_audio_files(args.inputa, args.inputb, args.output, args.mix_percentage)
@@ -1,63 +1,119 @@
 # Import the necessary libraries
-from cirq.contrib.qasm_import import circuit_from_qasm
+import argparse
+import multiprocessing
 import cirq
 import numpy as np
-import glob
-import wave
-import re
+import os
+import soundfile as sf
+from experiments import trace
+from experiments.quantum import statevector
+from experiments.quantum.archive import read_archive
+from experiments.quantum.circuits import parameter_resolvers
 
-def atoi(text):
-    return int(text) if text.isdigit() else text
+# The archive and simulation function, set once per worker process
+template = None
+columns = None
+parameters = None
+simulate_states = None
+debug = False
 
-def natural_keys(text):
-    '''
-    alist.sort(key=natural_keys) sorts in human order
-    http://nedbatchelder.com/blog/200712/human_sorting.html
-    (See Toothy's implementation in the comments)
-    '''
-    return [atoi(c) for c in re.split(r'(\d+)', text)]
+def init_worker(archive_file, backend='cirq', dtype=np.complex64, print_circuits=False):
+    global template, columns, parameters, simulate_states, debug
+    # Every worker maps the archive itself, so only row ranges are sent to it
+    template, columns, parameters, _ = read_archive(archive_file, mmap=True)
+    simulate_states = statevector.sweep_simulator(backend, dtype)
+    debug = print_circuits
 
-# Get a list of all .qasm files in the /data directory
-filenames = glob.glob('data/*.qasm')
+def amplitudes_to_pcm(amplitudes):
+    """Normalizes each row of amplitudes to its own peak and converts them all to 16-bit PCM at once."""
+    peaks = np.max(amplitudes, axis=1, keepdims=True)
+    peaks[peaks == 0] = 1
+    amplitudes *= 32767 / peaks
+    return amplitudes.astype(np.int16)
 
-# sort filenames alpha-numerically, so that _0, _1, _2, etc. are in order, NOT _0, _10, _11, etc.
-filenames.sort(key=natural_keys)
+def simulate_batch(args):
+    """Simulates the archived circuits in rows [start, stop), returning their amplitudes, or their PCM if per_chunk."""
+    start, stop, per_chunk = args
+    resolvers = parameter_resolvers(columns, parameters[start:stop])
 
-# Open the output .wav file
-with wave.open('output.wav', 'wb') as wave_file:
-    # Set the parameters
-    wave_file.setnchannels(1)
-    wave_file.setsampwidth(2)
-    wave_file.setframerate(44100)
+    if debug:
+        for i, resolver in enumerate(resolvers, start):
+            print(f'circuit {i}')
+            print(cirq.resolve_parameters(template, resolver))
 
-    # Iterate over each .qasm file
-    for filename in filenames:
-        print(filename)
-        # Read the .qasm file
-        with open(filename, 'r') as f:
-            qasm = f.read()
+    trace.count('chunks', stop - start)
+    trace.count('simulator_calls')
 
-        # Convert the .qasm file to a Cirq circuit
-        circuit = circuit_from_qasm(qasm)
+    # Collect the amplitudes of every chunk into one array, then convert the batch in one go
+    amplitudes = np.empty((stop - start, 2 ** len(template.all_qubits())), dtype=np.float32)
+    with trace.span('simulate', chunks=stop - start):
+        for i, state in enumerate(simulate_states(template, resolvers)):
+            np.abs(state, out=amplitudes[i])
 
-        print('circuit')
-        print(circuit)
+    if not per_chunk:
+        return amplitudes
+    with trace.span('normalize'):
+        return amplitudes_to_pcm(amplitudes)
 
-        # Simulate the circuit and get the final state vector
-        simulator = cirq.Simulator()
-        result = simulator.simulate(circuit)
-        final_state_vector = result.final_state_vector
+def main(archive_file=os.path.join('data', 'circuits.qca'), output_file='output.wav', workers=None, batch_size=8, backend='cirq', dtype=np.complex64,
+         normalize='chunk', print_circuits=False):
+    """Simulates every circuit of an archive written by script.py and writes their amplitudes as one WAV file.
 
-        # Convert the final state vector to wave data by taking the amplitude of each state
-        wave_data_chunk = np.abs(final_state_vector)
+    With normalize='chunk' each chunk is scaled to its own peak and written as 16-bit PCM. With
+    normalize='global' the amplitudes are written unscaled as 32-bit float, and the running peak
+    of the whole file is stored in its PEAK header chunk when it is closed, so a reader can
+    normalize it (see audio_io.peak) without a second pass over the audio. Returns that peak.
 
-        # Normalize the wave data to the range [-1, 1]
-        wave_data_chunk = wave_data_chunk * 1.0 / (max(abs(wave_data_chunk)))
+    Archives of multichannel input interleave the chunks of every channel; batches are rounded up to
+    whole groups of them, and the file gets a channel per input channel.
+    """
+    # Only the number of chunks, channels and the sample rate are needed here; workers read the rows they simulate
+    _, _, archive_parameters, metadata = read_archive(archive_file, mmap=True)
+    if metadata.get('readout', 'amplitudes') != 'amplitudes':
+        raise ValueError(f"{archive_file} was simulated with the {metadata['readout']} readout; only amplitudes can be replayed")
+    n_chunks = len(archive_parameters)
+    n_channels = metadata.get('channels', 1)
+    batch_size = -(-batch_size // n_channels) * n_channels
+    per_chunk = normalize == 'chunk'
+    batches = [(start, min(start + batch_size, n_chunks), per_chunk) for start in range(0, n_chunks, batch_size)]
 
-        # Convert the wave data to 16-bit PCM
-        wave_data_pcm = np.int16(wave_data_chunk * 32767)
+    # One writer for the whole file, buffering whole batches
+    subtype = 'PCM_16' if per_chunk else 'FLOAT'
+    peak = 0.0
+    with trace.span('backtowav.main', file=archive_file), \
+            sf.SoundFile(output_file, 'w', samplerate=metadata.get('sample_rate', 44100), channels=n_channels, subtype=subtype) as outfile:
+        def write(results):
+            nonlocal peak
+            for samples in results:
+                if not per_chunk:
+                    peak = max(peak, float(np.max(samples)))
 
-        # Write the wave data chunk to the .wav file
-        wave_file.writeframes(wave_data_pcm.tobytes())
+                # De-interleave the channels' chunks into frames
+                chunk_size = samples.shape[1]
+                outfile.write(samples.reshape(-1, n_channels, chunk_size).transpose(0, 2, 1).reshape(-1, n_channels))
 
-print('Finished')
+        if workers == 1:
+            init_worker(archive_file, backend, dtype, print_circuits)
+            write(map(simulate_batch, batches))
+        else:
+            with multiprocessing.Pool(workers, initializer=init_worker, initargs=(archive_file, backend, dtype, print_circuits)) as pool:
+                write(pool.imap(simulate_batch, batches))
+
+    print('Finished')
+    return peak
+
+# Command-line arguments parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the circuits of an archive written by script.py back into a .wav file.")
+    parser.add_argument('--archive', type=str, default=os.path.join('data', 'circuits.qca'), help='Path to the circuit archive')
+    parser.add_argument('--output', type=str, default='output.wav', help='Path to output file')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--batch_size', type=int, default=8, help='Number of circuits simulated as one parameter sweep by a worker')
+    parser.add_argument('--backend', type=str, default='cirq', choices=['cirq', 'numpy'], help='Simulate with Cirq or the in-house NumPy state-vector kernel')
+    parser.add_argument('--precision', type=str, default='complex64', choices=['complex64', 'complex128'], help='Precision of the simulated state vector')
+    parser.add_argument('--normalize', type=str, default='chunk', choices=['chunk', 'global'],
+                        help='Normalize each chunk to 16-bit PCM, or write float samples with the peak of the whole file in the header')
+    parser.add_argument('--debug', action='store_true', help='Print every circuit as it is simulated (slow)')
+    args = parser.parse_args()
+
+    main(args.archive, args.output, args.workers, args.batch_size, args.backend, np.dtype(args.precision).type, args.normalize, args.debug)
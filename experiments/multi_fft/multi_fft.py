@@ -0,0 +1,176 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import numpy as np
+import librosa
+import soundfile as sf
+from experiments import trace
+from experiments.audio_io import load_audio
+from experiments.render import PREVIEW_WIDTH, render_spectrogram
+
+def stft_method(stft, length):
+    # Invert the STFT, trimmed or padded to the input length
+    return librosa.istft(stft, length=length)
+
+def stft_transform(y):
+    # Looked up on call, as touching librosa.stft loads most of librosa
+    return librosa.stft(y)
+
+def fft_method(spectrum, length):
+    # Invert the real FFT; the input is real, so the half spectrum holds everything
+    return np.fft.irfft(spectrum, n=length)
+
+# Forward transforms, each computed once and shared by every method that inverts it
+TRANSFORMS = {
+    'stft': stft_transform,
+    'rfft': np.fft.rfft,
+}
+
+# Each method is the transform it inverts and how it inverts it. The DFT and FFT are the same
+# round trip, so they share one result
+METHODS = {
+    'stft': ('stft', stft_method),
+    'dft': ('rfft', fft_method),
+    'fft': ('rfft', fft_method),
+}
+
+def generate_spectrogram(y, sr, output_file):
+    # Generate spectrogram straight to an image, without a figure
+    render_spectrogram(y, output_file, width=PREVIEW_WIDTH)
+
+def method_file(name, output_file):
+    """Output path of a method: output_file with the method name prefixed to its file name."""
+    directory, file_name = os.path.split(output_file)
+    return os.path.join(directory, f"{name}_{file_name}")
+
+def signal_to_noise(y, y_reconstructed):
+    """SNR of a reconstruction in dB, or None if it is exact."""
+    noise = np.sum((y - y_reconstructed) ** 2, dtype=np.float64)
+    if noise == 0:
+        return None
+    return float(10 * np.log10(np.sum(y ** 2, dtype=np.float64) / noise))
+
+def warm_up(methods, shape, dtype):
+    """Runs each method's transform and inverse once on a short signal, so lazy imports and first-call setup aren't timed."""
+    y = np.zeros(shape[:-1] + (4096,), dtype=dtype)
+    for transform, inverse in dict.fromkeys(METHODS[name] for name in methods):
+        inverse(TRANSFORMS[transform](y), y.shape[-1])
+
+def peak_memory(span):
+    """Peak traced memory of a finished trace span, or None unless tracing records memory peaks (see trace.py)."""
+    return None if span is None else span.args.get('peak_memory')
+
+# The signal and its forward transforms, set once per worker process
+shared = {}
+
+def init_worker(y, sr, spectra):
+    shared.update(y=y, sr=sr, spectra=spectra)
+
+def run_method(args):
+    """Inverts one shared transform, then writes and renders the result under every method name using it."""
+    names, transform, inverse, output_file, mix, spectrograms = args
+    y = shared['y']
+    sr = shared['sr']
+
+    with trace.span('method', transform=transform) as span:
+        start = time.perf_counter()
+        with trace.span('inverse', transform=transform):
+            y_reconstructed = inverse(shared['spectra'][transform], y.shape[-1])
+        inverse_seconds = time.perf_counter() - start
+
+        with trace.span('normalize'):
+            # Mix original and transformed audio
+            mix_b = mix / 100.0
+            mix_a = 1.0 - mix_b
+            mixed_y = y * mix_a + y_reconstructed * mix_b
+
+            # Normalize audio signals, all channels together
+            mixed_y = librosa.util.normalize(mixed_y, axis=None)
+
+        # Write and render the first method, then copy its files for the methods sharing the result
+        start = time.perf_counter()
+        first_file = method_file(names[0], output_file)
+        with trace.span('write'):
+            sf.write(first_file, mixed_y.T, sr)
+        if spectrograms:
+            generate_spectrogram(mixed_y, sr, f"{first_file}.png")
+        for name in names[1:]:
+            shutil.copyfile(first_file, method_file(name, output_file))
+            if spectrograms:
+                shutil.copyfile(f"{first_file}.png", f"{method_file(name, output_file)}.png")
+        render_seconds = time.perf_counter() - start
+
+    report = {
+        'transform': transform,
+        'snr_db': signal_to_noise(y, y_reconstructed),
+        'inverse_seconds': inverse_seconds,
+        'render_seconds': render_seconds,
+        'peak_memory_bytes': peak_memory(span),
+    }
+    return {name: dict(report, shared_with=[other for other in names if other != name]) for name in names}
+
+def process_audio(input_file, output_file, mix=100, methods=tuple(METHODS), workers=None, spectrograms=True, mono=True):
+    """Round-trips the audio through each method, writing {method}_{output file name}, its spectrogram and a JSON report.
+
+    spectrograms=False skips rendering the images. mono=False keeps every channel, transforming
+    them all in one call along the last axis.
+
+    The report (output_file with a _report.json suffix) holds each reconstruction's SNR and the time
+    spent in its forward transform, inverse and rendering, measured after a warm-up run so imports
+    aren't counted. Peak memory is only measured, from tracemalloc, when tracing records memory peaks
+    (QUANTUM_MUSIC_TRACE_MEMORY=1, see trace.py), as tracing slows the transforms down; it is None otherwise.
+    """
+    with trace.span('multi_fft.process_audio', file=input_file):
+        # Load audio at 44.1kHz
+        y, sr = load_audio(input_file, sr=44100, mono=mono)
+
+        # Load the libraries and set up every transform before timing any of them; forked workers inherit this
+        with trace.span('warm_up'):
+            warm_up(methods, y.shape, y.dtype)
+
+        # Compute every forward transform the requested methods need, once each
+        spectra = {}
+        transforms = {}
+        for transform in dict.fromkeys(METHODS[name][0] for name in methods):
+            with trace.span('transform', transform=transform) as span:
+                start = time.perf_counter()
+                spectra[transform] = TRANSFORMS[transform](y)
+                seconds = time.perf_counter() - start
+            transforms[transform] = {'seconds': seconds, 'peak_memory_bytes': peak_memory(span)}
+
+        # Methods that invert the same transform the same way share one job
+        jobs = {}
+        for name in methods:
+            jobs.setdefault(METHODS[name], []).append(name)
+        jobs = [(names, transform, inverse, output_file, mix, spectrograms) for (transform, inverse), names in jobs.items()]
+
+        # Invert and render the jobs in parallel, each worker receiving the signal and spectra once
+        if workers == 1:
+            init_worker(y, sr, spectra)
+            results = list(map(run_method, jobs))
+        else:
+            workers = workers or min(len(jobs), os.cpu_count())
+            with multiprocessing.Pool(workers, initializer=init_worker, initargs=(y, sr, spectra)) as pool:
+                results = pool.map(run_method, jobs)
+
+    report = {
+        'input': input_file,
+        'sample_rate': sr,
+        'channels': 1 if y.ndim == 1 else len(y),
+        'samples': y.shape[-1],
+        'mix': mix,
+        'transforms': transforms,
+        'methods': {name: result[name] for result in results for name in result},
+    }
+    for method in report['methods'].values():
+        method['transform_seconds'] = transforms[method['transform']]['seconds']
+
+    with open(f"{os.path.splitext(output_file)[0]}_report.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+# Test the function
+if __name__ == "__main__":
+    process_audio('../../wavs/input.wav', 'output.wav', mix=100)
@@ -0,0 +1,104 @@
+import json
+import os
+import struct
+import cirq
+import numpy as np
+
+# A circuit archive is one file holding a parameterized circuit template and a table of parameter values,
+# one row per circuit:
+#   MAGIC | header length (uint64) | JSON header, space-padded | rows (little-endian, row-major)
+# The header holds the template as Cirq JSON, the parameter name of each column, the row dtype and any
+# metadata. Rows are fixed-width and start on an aligned offset, so row i lives at
+# offset + i * row_bytes: the file is its own index and can be memory-mapped as an array
+MAGIC = b'QMCIRC01'
+ALIGNMENT = 64
+
+class ArchiveWriter:
+    """Writes a circuit archive row by row, in order with append() or at any row with write().
+
+    The archive is written to a temporary file that replaces path when the writer is closed, so
+    readers never see a partial archive. Rows never written read back as zeros.
+    """
+
+    def __init__(self, path, template, columns, dtype=np.float64, metadata=None):
+        self.path = path
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.row_bytes = self.dtype.itemsize * len(self.columns)
+        self.rows = 0
+
+        header = json.dumps({
+            'template': cirq.to_json(template, indent=None, separators=(',', ':')),
+            'columns': self.columns,
+            'dtype': self.dtype.str,
+            'metadata': metadata or {},
+        }).encode()
+        # Pad the header so the rows start on an aligned offset
+        header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+        self.offset = len(MAGIC) + 8 + len(header)
+
+        self.temporary_file = f'{path}.{os.getpid()}.tmp'
+        self.file = open(self.temporary_file, 'wb')
+        self.file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+
+    def write(self, index, rows):
+        """Writes rows (one row or a 2D array of them) starting at row index."""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape(-1, len(self.columns))
+        self.file.seek(self.offset + index * self.row_bytes)
+        self.file.write(rows.data)
+        self.rows = max(self.rows, index + len(rows))
+
+    def append(self, rows):
+        self.write(self.rows, rows)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            os.replace(self.temporary_file, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't replace a good archive with a broken one
+            self.file.close()
+            os.remove(self.temporary_file)
+
+def read_header(f):
+    """Reads the header of an open archive, returning (header dict, offset of the first row, number of rows)."""
+    magic, length = struct.unpack(f'<{len(MAGIC)}sQ', f.read(len(MAGIC) + 8))
+    if magic != MAGIC:
+        raise ValueError(f'{f.name} is not a circuit archive')
+    header = json.loads(f.read(length))
+    offset = len(MAGIC) + 8 + length
+    row_bytes = np.dtype(header['dtype']).itemsize * len(header['columns'])
+    rows = (os.fstat(f.fileno()).st_size - offset) // row_bytes
+    return header, offset, rows
+
+def read_archive(path, mmap=False):
+    """Loads an archive as (template, columns, parameters, metadata), reading all rows at once.
+
+    parameters is a (circuits, columns) array; with mmap it is a read-only memory map instead, so
+    single rows can be looked up without reading the rest.
+    """
+    with open(path, 'rb') as f:
+        header, offset, rows = read_header(f)
+        shape = (rows, len(header['columns']))
+        if mmap:
+            parameters = np.memmap(path, dtype=header['dtype'], mode='r', offset=offset, shape=shape)
+        else:
+            parameters = np.fromfile(f, dtype=header['dtype'], count=shape[0] * shape[1]).reshape(shape)
+    template = cirq.read_json(json_text=header['template'])
+    return template, header['columns'], parameters, header['metadata']
+
+def iter_archive(path, batch_size=1024):
+    """Streams an archive as (start row, rows) batches of at most batch_size rows, in order."""
+    with open(path, 'rb') as f:
+        header, _, rows = read_header(f)
+        n_columns = len(header['columns'])
+        for start in range(0, rows, batch_size):
+            count = min(batch_size, rows - start)
+            yield start, np.fromfile(f, dtype=header['dtype'], count=count * n_columns).reshape(count, n_columns)
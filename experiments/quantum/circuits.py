@@ -0,0 +1,55 @@
+import functools
+import cirq
+import numpy as np
+import sympy
+
+@functools.lru_cache(maxsize=None)
+def qft(qubits, exponent_sign=1, swaps=False):
+    """Constructs the QFT on the given tuple of qubits, once per qubit layout.
+
+    script.py uses the negative-exponent ladder followed by the qubit-reversing SWAPs,
+    stft_quantum_2.py the positive one without SWAPs. The result is frozen because it is shared.
+    """
+    circuit = cirq.Circuit()
+    for i in range(len(qubits)):
+        for j in range(i):
+            circuit.append(cirq.CZPowGate(exponent=exponent_sign * 2 ** (j - i)).on(qubits[i], qubits[j]))
+        circuit.append(cirq.H(qubits[i]))
+    if swaps:
+        for i in range(len(qubits) // 2):
+            circuit.append(cirq.SWAP(qubits[i], qubits[-i - 1]))
+    return circuit.freeze()
+
+@functools.lru_cache(maxsize=None)
+def qft_unitary(qubits, exponent_sign=1, swaps=False):
+    """Precomputed unitary of the cached QFT. It has 4**n entries, so only use it for small qubit counts."""
+    unitary = cirq.unitary(qft(qubits, exponent_sign, swaps))
+    unitary.flags.writeable = False
+    return unitary
+
+@functools.lru_cache(maxsize=None)
+def fourier_encoding_template(qubits):
+    """QFT followed by rz(magnitude_i) and rx(phase_i) on each qubit, with the angles left as sympy symbols."""
+    circuit = qft(qubits, exponent_sign=-1, swaps=True).unfreeze()
+    for i, qubit in enumerate(qubits):
+        circuit.append(cirq.rz(sympy.Symbol(f'magnitude_{i}'))(qubit))
+        circuit.append(cirq.rx(sympy.Symbol(f'phase_{i}'))(qubit))
+    return circuit.freeze()
+
+def fourier_encoding_columns(n_qubits):
+    """Symbol names of fourier_encoding_template, in the column order of fourier_encoding_parameters."""
+    return [f'magnitude_{i}' for i in range(n_qubits)] + [f'phase_{i}' for i in range(n_qubits)]
+
+def fourier_encoding_parameters(fft_data_chunks):
+    """A row of parameter values per row of Fourier coefficients: every magnitude, then every phase."""
+    fft_data_chunks = np.atleast_2d(fft_data_chunks)
+    return np.concatenate([np.abs(fft_data_chunks), np.angle(fft_data_chunks)], axis=1)
+
+def parameter_resolvers(columns, parameters):
+    """One ParamResolver per row of parameter values, mapping each column name to its value."""
+    return [cirq.ParamResolver(dict(zip(columns, row))) for row in np.atleast_2d(parameters).tolist()]
+
+def fourier_encoding_resolvers(fft_data_chunks):
+    """One ParamResolver per row of Fourier coefficients, filling in fourier_encoding_template."""
+    fft_data_chunks = np.atleast_2d(fft_data_chunks)
+    return parameter_resolvers(fourier_encoding_columns(fft_data_chunks.shape[1]), fourier_encoding_parameters(fft_data_chunks))
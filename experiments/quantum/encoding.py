@@ -0,0 +1,70 @@
+import cirq
+import numpy as np
+
+def n_qubits_for(length):
+    """Qubits needed to hold length amplitudes, ceil(log2(length)), and at least one."""
+    return max(1, int(np.ceil(np.log2(length))))
+
+def amplitude_states(values, n_qubits=None):
+    """Normalizes each row of real values into a state vector of 2**n_qubits amplitudes, zero-padding the rest.
+
+    n_qubits defaults to n_qubits_for the row length. Rows of zeros become |0...0>.
+    """
+    values = np.atleast_2d(values)
+    n_qubits = n_qubits or n_qubits_for(values.shape[1])
+    states = np.zeros((len(values), 2 ** n_qubits))
+    states[:, :values.shape[1]] = values
+
+    norms = np.linalg.norm(states, axis=1)
+    states[norms == 0, 0] = 1
+    norms[norms == 0] = 1
+    states /= norms[:, np.newaxis]
+    return states
+
+def preparation_angles(state):
+    """Ry angles of the binary tree preparing a real state vector from |0...0>.
+
+    Returns one array per qubit, most significant first: qubit k gets 2**k angles, one for each value
+    of the qubits before it, splitting the weight of that branch between its 0 and 1 halves. The last
+    qubit splits single amplitudes, so it also carries their signs.
+    """
+    n_qubits = n_qubits_for(len(state))
+    angles = []
+    for k in range(n_qubits):
+        halves = state.reshape(2 ** k, 2, -1)
+        if k == n_qubits - 1:
+            zero, one = halves[:, 0, 0], halves[:, 1, 0]
+        else:
+            zero, one = np.linalg.norm(halves, axis=2).T
+        angles.append(2 * np.arctan2(one, zero))
+    return angles
+
+def prepare_state(state, qubits):
+    """Operations preparing the real, normalized state from |0...0> on ceil(log2(len(state))) qubits.
+
+    Each qubit gets a uniformly controlled Ry: a rotation for every value of the qubits before it,
+    controlled on that value. Rotations by zero are left out, so zero-padded or sparse states need
+    few gates. Qubit 0 is the most significant, like Cirq's state vector ordering.
+    """
+    operations = []
+    for k, level in enumerate(preparation_angles(state)):
+        for branch, angle in enumerate(level):
+            if np.isclose(angle, 0):
+                continue
+            rotation = cirq.ry(angle).on(qubits[k])
+            if k:
+                control_values = [int(bit) for bit in format(branch, f'0{k}b')]
+                rotation = rotation.controlled_by(*qubits[:k], control_values=control_values)
+            operations.append(rotation)
+    return operations
+
+def check_state_preparation(state, atol=1e-6):
+    """Raises AssertionError if prepare_state's circuit doesn't prepare state, returning the max difference."""
+    state = amplitude_states(state)[0]
+    qubits = cirq.LineQubit.range(n_qubits_for(len(state)))
+    circuit = cirq.Circuit(prepare_state(state, qubits))
+    prepared = cirq.final_state_vector(circuit, qubit_order=qubits, dtype=np.complex128)
+    difference = np.max(np.abs(prepared - state))
+    if difference > atol:
+        raise AssertionError(f'State preparation differs from the target state by {difference:.3g} (atol {atol:.3g})')
+    return difference
@@ -0,0 +1,110 @@
+import collections
+import os
+import numpy as np
+from experiments import trace
+from experiments.audio_io import atomic_write
+
+class QuantizedCache:
+    """Bounded LRU cache of simulation outputs, keyed on circuit parameters rounded to a resolution.
+
+    Parameters are rounded to the nearest multiple of resolution (a scalar, or one value per column)
+    and only the rounded values are ever simulated, so every row that rounds the same way gets the
+    same output, whichever row was simulated first. The maxsize most recently used outputs are kept.
+
+    Given a cache_file, the cache starts from the entries saved there by save() with the same
+    resolution. hits and misses count rows; max_parameter_error is the largest rounding seen, and
+    with measure_error every miss is also simulated at its exact parameters to track
+    max_output_error, the largest difference rounding made to an output.
+    """
+
+    def __init__(self, resolution, maxsize=4096, cache_file=None, measure_error=False):
+        self.resolution = np.asarray(resolution, dtype=np.float64)
+        self.maxsize = maxsize
+        self.cache_file = cache_file
+        self.measure_error = measure_error
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.max_parameter_error = 0.0
+        self.max_output_error = None
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load(cache_file)
+
+    def quantize(self, parameters):
+        """Rounded parameters and the key of each of their rows."""
+        steps = np.rint(np.atleast_2d(parameters) / self.resolution).astype(np.int64)
+        quantized = steps * self.resolution
+        if quantized.size:
+            self.max_parameter_error = max(self.max_parameter_error, float(np.max(np.abs(quantized - parameters))))
+        return quantized, [row.tobytes() for row in steps]
+
+    def lookup(self, parameters, simulate):
+        """Outputs for every row of parameters, stacked, and the rounded parameters they were simulated with.
+
+        simulate takes a 2D array of parameter rows and returns an output per row; it is only called
+        once, with the rounded rows that aren't cached yet.
+        """
+        quantized, keys = self.quantize(parameters)
+
+        # Rows that aren't cached yet, once per key
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            elif key in missing:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing[key] = i
+
+        trace.count('cache_hits', len(keys) - len(missing))
+        trace.count('cache_misses', len(missing))
+
+        new_outputs = {}
+        if missing:
+            rows = list(missing.values())
+            if self.measure_error:
+                outputs = simulate(np.concatenate([quantized[rows], np.atleast_2d(parameters)[rows]]))
+                outputs, exact = np.asarray(outputs[:len(rows)]), np.asarray(outputs[len(rows):])
+                error = float(np.max(np.abs(outputs.astype(np.float64) - exact)))
+                self.max_output_error = max(self.max_output_error or 0.0, error)
+            else:
+                outputs = simulate(quantized[rows])
+            new_outputs = dict(zip(missing, outputs))
+
+        stacked = np.stack([new_outputs[key] if key in new_outputs else self.entries[key] for key in keys])
+
+        # Keep the new outputs, evicting the least recently used ones beyond maxsize
+        for key, output in new_outputs.items():
+            self.entries[key] = output
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return stacked, quantized
+
+    def stats(self):
+        """Hit and miss counts, hit rate and quantization errors, as a dict."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries), 'max_parameter_error': self.max_parameter_error,
+                'max_output_error': self.max_output_error}
+
+    def load(self, cache_file):
+        with np.load(cache_file) as saved:
+            if saved['resolution'].shape != self.resolution.shape or not np.all(saved['resolution'] == self.resolution):
+                return
+            for key, output in zip(saved['keys'], saved['outputs']):
+                self.entries[key.tobytes()] = output
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def save(self, cache_file=None):
+        """Writes the entries, least recently used first, to cache_file (by default the one it was loaded from)."""
+        cache_file = cache_file or self.cache_file
+        if not self.entries:
+            return
+        keys = np.stack([np.frombuffer(key, dtype=np.int64) for key in self.entries])
+        outputs = np.stack(list(self.entries.values()))
+
+        with atomic_write(cache_file) as f:
+            np.savez(f, resolution=self.resolution, keys=keys, outputs=outputs)
@@ -0,0 +1,261 @@
+import cirq
+import numpy as np
+from experiments.quantum.statevector import _matrix, _value
+
+# Instructions understood by run(), compiled once per circuit
+MATRIX, CPHASE, SWAP, UNITARY = range(4)
+
+SWAP_GATE = np.eye(4)[[0, 2, 1, 3]].reshape(2, 2, 2, 2)
+
+# Singular values whose squared weight is below this fraction of the total are SVD rounding noise, always dropped
+NEGLIGIBLE = 1e-24
+
+class MPS:
+    """Matrix product state of n qubits, one (left bond, 2, right bond) tensor per site.
+
+    Sites hold qubits in any order, so two-qubit gates between distant qubits swap one of them next
+    to the other and leave it there. Every two-qubit gate is split back into two sites by an SVD that
+    keeps at most max_bond singular values, and drops those whose squared weight is below cutoff
+    times the total. The dropped weight is recorded: truncation_error is 1 minus the product of the
+    kept fractions, an estimate of the infidelity to the exact state. With max_bond=None and
+    cutoff=0 only rounding noise is dropped, and bonds grow as entanglement requires.
+    """
+
+    def __init__(self, tensors, qubits=None, max_bond=None, cutoff=0.0):
+        self.tensors = tensors
+        self.qubits = list(range(len(tensors))) if qubits is None else list(qubits)
+        self.sites = {qubit: site for site, qubit in enumerate(self.qubits)}
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        self.fidelity = 1.0
+        self.bond_dimension = max(tensor.shape[2] for tensor in tensors)
+
+        # The orthogonality center: sites left of it are left-orthonormal, sites right of it right-orthonormal
+        self.center = len(tensors) - 1
+        self._move_center(0)
+
+    @classmethod
+    def zeros(cls, n_qubits, max_bond=None, cutoff=0.0, dtype=np.complex128):
+        """|0...0>, a product state."""
+        tensors = [np.zeros((1, 2, 1), dtype=dtype) for _ in range(n_qubits)]
+        for tensor in tensors:
+            tensor[0, 0, 0] = 1
+        return cls(tensors, max_bond=max_bond, cutoff=cutoff)
+
+    @classmethod
+    def from_state_vector(cls, state, max_bond=None, cutoff=0.0, dtype=np.complex128):
+        """Splits a normalized state vector of 2**n amplitudes into sites by successive SVDs, truncating each bond."""
+        state = np.asarray(state, dtype=dtype)
+        n_qubits = int(np.log2(len(state)))
+        mps = cls.zeros(n_qubits, max_bond, cutoff, dtype)
+
+        rest = state.reshape(1, -1)
+        for site in range(n_qubits - 1):
+            left = rest.shape[0]
+            u, s, vh = np.linalg.svd(rest.reshape(left * 2, -1), full_matrices=False)
+            keep = mps._truncate(s)
+            mps.tensors[site] = u[:, :keep].reshape(left, 2, keep)
+            rest = s[:keep, np.newaxis] * vh[:keep]
+        mps.tensors[-1] = rest.reshape(-1, 2, 1)
+        mps.center = n_qubits - 1
+        return mps
+
+    @property
+    def truncation_error(self):
+        # Renormalizing can leave the fidelity a rounding error above 1
+        return max(0.0, 1.0 - self.fidelity)
+
+    def _truncate(self, s):
+        """Number of singular values to keep, recording the weight dropped and renormalizing the kept ones in place."""
+        weights = s ** 2
+        total = weights.sum()
+        keep = max(1, int(np.count_nonzero(weights > max(self.cutoff, NEGLIGIBLE) * total)))
+        if self.max_bond is not None:
+            keep = min(keep, self.max_bond)
+        if keep < len(s):
+            kept = weights[:keep].sum()
+            self.fidelity *= kept / total
+            s[:keep] *= np.sqrt(total / kept)
+        self.bond_dimension = max(self.bond_dimension, keep)
+        return keep
+
+    def _move_center(self, site):
+        """Moves the orthogonality center to site by QR decompositions, which change no amplitudes."""
+        tensors = self.tensors
+        while self.center < site:
+            tensor = tensors[self.center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape(left * 2, right))
+            tensors[self.center] = q.reshape(left, 2, -1)
+            tensors[self.center + 1] = np.tensordot(r, tensors[self.center + 1], axes=(1, 0))
+            self.center += 1
+        while self.center > site:
+            tensor = tensors[self.center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape(left, 2 * right).T)
+            tensors[self.center] = q.T.reshape(-1, 2, right)
+            tensors[self.center - 1] = np.tensordot(tensors[self.center - 1], r.T, axes=(2, 0))
+            self.center -= 1
+
+    def apply_matrix(self, u, qubit):
+        """Applies a 2x2 unitary to a qubit. Unitaries on one site keep the canonical form, so nothing is truncated."""
+        site = self.sites[qubit]
+        self.tensors[site] = np.einsum('ab,lbr->lar', u, self.tensors[site])
+
+    def _apply_adjacent(self, u, site):
+        """Applies a (2, 2, 2, 2) two-qubit unitary to sites site and site + 1, splitting them back by a truncated SVD."""
+        self._move_center(site)
+        a, b = self.tensors[site], self.tensors[site + 1]
+        theta = np.einsum('cdab,labm->lcdm', u, np.tensordot(a, b, axes=(2, 0)).reshape(a.shape[0], 2, 2, b.shape[2]))
+        left, right = theta.shape[0], theta.shape[3]
+
+        u_, s, vh = np.linalg.svd(theta.reshape(left * 2, 2 * right), full_matrices=False)
+        keep = self._truncate(s)
+        self.tensors[site] = u_[:, :keep].reshape(left, 2, keep)
+        self.tensors[site + 1] = (s[:keep, np.newaxis] * vh[:keep]).reshape(keep, 2, right)
+        self.center = site + 1
+
+    def _swap_sites(self, site):
+        """Swaps the qubits on site and site + 1."""
+        self._apply_adjacent(SWAP_GATE, site)
+        self.qubits[site], self.qubits[site + 1] = self.qubits[site + 1], self.qubits[site]
+        self.sites[self.qubits[site]] = site
+        self.sites[self.qubits[site + 1]] = site + 1
+
+    def apply_two_qubit(self, u, qubit_a, qubit_b):
+        """Applies a 4x4 unitary, qubit_a being the most significant, moving qubit_a next to qubit_b first."""
+        site_a, site_b = self.sites[qubit_a], self.sites[qubit_b]
+        step = 1 if site_b > site_a else -1
+        while abs(site_b - site_a) > 1:
+            self._swap_sites(min(site_a, site_a + step))
+            site_a += step
+
+        u = np.asarray(u).reshape(2, 2, 2, 2)
+        if site_a < site_b:
+            self._apply_adjacent(u, site_a)
+        else:
+            self._apply_adjacent(u.transpose(1, 0, 3, 2), site_b)
+
+    def state_vector(self, dtype=None):
+        """The 2**n amplitudes, with qubit 0 the most significant like Cirq's state vectors."""
+        state = self.tensors[0].reshape(2, -1)
+        for tensor in self.tensors[1:]:
+            state = np.tensordot(state, tensor, axes=(-1, 0)).reshape(-1, tensor.shape[2])
+        state = state.reshape((2,) * len(self.tensors)).transpose(np.argsort(self.qubits))
+        return state.ravel().astype(dtype or state.dtype, copy=False)
+
+    def expectation_z(self):
+        """<Z> of every qubit, in qubit order, without building the state vector."""
+        z_expectation = np.empty(len(self.tensors))
+        for site in range(len(self.tensors)):
+            # At the orthogonality center the whole state's weight is in the one tensor
+            self._move_center(site)
+            probabilities = np.sum(np.abs(self.tensors[site]) ** 2, axis=(0, 2))
+            z_expectation[self.qubits[site]] = (probabilities[0] - probabilities[1]) / probabilities.sum()
+        return z_expectation
+
+def compile_circuit(circuit, qubit_order=cirq.QubitOrder.DEFAULT):
+    """Compiles a circuit into a list of (kind, gate, qubit indices, trivial_on_zero) instructions for run().
+
+    Qubits are ordered like cirq.Simulator orders them. As in statevector.compile_circuit, controlled
+    phases on a qubit that is still |0> are marked, so run() skips them when starting from |0...0>;
+    the QFT's whole ladder is such gates. Raises ValueError for operations on more than two qubits,
+    which have to be decomposed first, and for operations without a unitary.
+    """
+    qubits = cirq.QubitOrder.as_qubit_order(qubit_order).order_for(circuit.all_qubits())
+    axis = {qubit: i for i, qubit in enumerate(qubits)}
+
+    instructions = []
+    touched = set()
+    for op in circuit.all_operations():
+        gate = op.gate
+        axes = tuple(axis[qubit] for qubit in op.qubits)
+        if not cirq.has_unitary(op) and not cirq.is_parameterized(op):
+            raise ValueError(f'Operation {op!r} has no unitary and cannot be simulated by the MPS kernel')
+        if len(axes) > 2:
+            raise ValueError(f'Operation {op!r} acts on {len(axes)} qubits; decompose it into one- and two-qubit gates first')
+
+        if len(axes) == 1:
+            instructions.append((MATRIX, gate, axes, False))
+            if not isinstance(gate, cirq.ZPowGate):
+                touched.add(axes[0])
+        elif isinstance(gate, cirq.CZPowGate):
+            instructions.append((CPHASE, gate, axes, not touched.issuperset(axes)))
+        elif gate == cirq.SWAP:
+            instructions.append((SWAP, gate, axes, False))
+            if len(touched.intersection(axes)) == 1:
+                touched.symmetric_difference_update(axes)
+        else:
+            instructions.append((UNITARY, gate, axes, False))
+            touched.update(axes)
+    return len(qubits), instructions
+
+def run(compiled, resolver=None, initial_state=None, max_bond=None, cutoff=0.0, dtype=np.complex128):
+    """Applies compiled instructions to an MPS, |0...0> by default, and returns it.
+
+    initial_state is an MPS, which is updated in place, or a state vector, which is split into one
+    with the same truncation.
+    """
+    n_qubits, instructions = compiled
+    resolver = cirq.ParamResolver(resolver)
+
+    if initial_state is None:
+        mps = MPS.zeros(n_qubits, max_bond, cutoff, dtype)
+    elif isinstance(initial_state, MPS):
+        mps = initial_state
+    else:
+        mps = MPS.from_state_vector(initial_state, max_bond, cutoff, dtype)
+
+    for kind, gate, axes, trivial_on_zero in instructions:
+        if kind == MATRIX:
+            mps.apply_matrix(_matrix(gate, resolver), axes[0])
+        elif kind == CPHASE:
+            # Controlled phases are diagonal, so build them directly instead of asking Cirq
+            exponent, global_shift = _value(gate, resolver)
+            global_phase = np.exp(1j * np.pi * exponent * global_shift)
+            if trivial_on_zero and initial_state is None:
+                # A qubit is still |0>, so only the global phase is left
+                mps.tensors[0] = mps.tensors[0] * global_phase
+                continue
+            phases = np.full(4, global_phase)
+            phases[3] *= np.exp(1j * np.pi * exponent)
+            mps.apply_two_qubit(np.diag(phases), *axes)
+        elif kind == SWAP:
+            # Relabel the qubits instead of moving any amplitudes
+            site_a, site_b = mps.sites[axes[0]], mps.sites[axes[1]]
+            mps.qubits[site_a], mps.qubits[site_b] = axes[1], axes[0]
+            mps.sites[axes[0]], mps.sites[axes[1]] = site_b, site_a
+        else:
+            mps.apply_two_qubit(cirq.unitary(cirq.resolve_parameters(gate, resolver)), *axes)
+
+    return mps
+
+def simulate(circuit, resolver=None, max_bond=None, cutoff=0.0, dtype=np.complex128, qubit_order=cirq.QubitOrder.DEFAULT, initial_state=None):
+    """Final state of a unitary circuit as an MPS with at most max_bond singular values per bond."""
+    return run(compile_circuit(circuit, qubit_order), resolver, initial_state, max_bond, cutoff, dtype)
+
+def simulate_sweep(circuit, resolvers, max_bond=None, cutoff=0.0, qubit_order=cirq.QubitOrder.DEFAULT):
+    """Yields the final MPS for every resolver, compiling the circuit once, like statevector.simulate_sweep.
+
+    Nothing is contracted: call state_vector() or expectation_z() on each MPS for what it is needed for.
+    """
+    compiled = compile_circuit(circuit, qubit_order)
+    for resolver in resolvers:
+        yield run(compiled, resolver, max_bond=max_bond, cutoff=cutoff)
+
+def check_against_cirq(circuit, resolver=None, max_bond=None, cutoff=0.0, atol=1e-6):
+    """Compares the MPS kernel's final state with Cirq's, returning (max difference, truncation error, bond dimension).
+
+    Without truncation it raises AssertionError if the states differ by more than atol; with it, if the
+    infidelity to Cirq's state exceeds twice the reported truncation error, plus atol.
+    """
+    expected = cirq.Simulator(dtype=np.complex128).simulate(circuit, resolver).final_state_vector
+    mps = simulate(circuit, resolver, max_bond, cutoff)
+    actual = mps.state_vector()
+    difference = np.max(np.abs(actual - expected))
+    infidelity = 1.0 - abs(np.vdot(expected, actual)) ** 2
+    if mps.truncation_error == 0 and difference > atol:
+        raise AssertionError(f'MPS kernel differs from Cirq by {difference:.3g} (atol {atol:.3g})')
+    if infidelity > 2 * mps.truncation_error + atol:
+        raise AssertionError(f'MPS infidelity {infidelity:.3g} exceeds twice its truncation error {mps.truncation_error:.3g}')
+    return difference, mps.truncation_error, mps.bond_dimension
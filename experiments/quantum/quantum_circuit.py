@@ -1,51 +1,39 @@
 import cirq
 import numpy as np
 import pretty_midi
+from experiments import trace
+from experiments.quantum import sampling
 
-# Create a PrettyMIDI object
-midi = pretty_midi.PrettyMIDI()
-
-# Create an Instrument instance for a drum instrument (use 0 for 'Acoustic Grand Piano')
-drum = pretty_midi.Instrument(program=0)
-
-def generate_midi(matrix):
-    # convert matrix into string
-    pattern = ''
-    for row in matrix:
-        for column in row:
-            pattern += str(column) + ' '  # append a space after each number
-        pattern += '\n'
-
-    # Split the pattern into lines
-    lines = pattern.strip().split("\n")
-
-    # Iterate over each line
-    for note_number, line in enumerate(lines, start=60-24):  # 60 is middle C
-        # Split the line into beats
-        beats = line.split()
-
-        # Iterate over each beat
-        for beat_number, beat in enumerate(beats):
-            # If the beat is a 1, add a note
-            if beat == '1':
-                # Create a Note instance for this note
-                note = pretty_midi.Note(
-                    velocity=100,  # how loud the note is
-                    pitch=note_number,  # which note to play
-                    start=beat_number / 4,  # when the note starts, each beat is 1 second
-                    end=(beat_number + 1) / 4  # when the note ends, each beat lasts 1 second
-                )
-
-                # Add it to our drum instrument
-                drum.notes.append(note)
+def generate_midi(matrix, output_file='output.mid'):
+    # Create a fresh PrettyMIDI object and drum instrument (use 0 for 'Acoustic Grand Piano') for every pattern
+    midi = pretty_midi.PrettyMIDI()
+    drum = pretty_midi.Instrument(program=0)
+
+    # Every 1 in the matrix is a note: the row picks the pitch (60 is middle C), the column the beat
+    note_numbers, beat_numbers = np.nonzero(np.asarray(matrix) == 1)
+    pitches = (note_numbers + 60 - 24).tolist()
+    starts = (beat_numbers / 4).tolist()  # when the note starts, each beat lasts a quarter second
+    ends = ((beat_numbers + 1) / 4).tolist()
+
+    # Add them to our drum instrument, velocity is how loud the note is
+    drum.notes = [pretty_midi.Note(velocity=100, pitch=pitch, start=start, end=end)
+                  for pitch, start, end in zip(pitches, starts, ends)]
 
     # Add the drum instrument to the PrettyMIDI object
     midi.instruments.append(drum)
 
     # Write out the MIDI data
-    midi.write('output.mid')
+    if output_file is not None:
+        midi.write(output_file)
+    return midi
 
-def generate_quantum_circuit(repetitions):
+def generate_quantum_circuit(repetitions, midi_file='output.mid', seed=None, backend='numpy'):
+    """Beat pattern of 8 rows and 2 * repetitions columns drawn from 16 measured qubits in superposition.
+
+    The numpy backend samples the measurements directly with a generator seeded by seed (see
+    sampling.run), falling back to Cirq for circuits it can't; the cirq backend always runs
+    cirq.Simulator. With midi_file=None no MIDI file is built, which is the slow part of large patterns.
+    """
     # Create a quantum circuit
     circuit = cirq.Circuit()
 
@@ -56,36 +44,37 @@ def generate_quantum_circuit(repetitions):
     for qubit in qubits:
         circuit.append(cirq.H(qubit))
 
-    # Measure each qubit
-    for qubit in qubits:
-        circuit.append(cirq.measure(qubit))
+    # Measure all qubits under a single key
+    circuit.append(cirq.measure(*qubits, key='beats'))
 
     # Run the circuit multiple times
-    simulator = cirq.Simulator()
-    result = simulator.run(circuit, repetitions=repetitions)
+    trace.count('simulator_calls')
+    with trace.span('sample', repetitions=repetitions):
+        if backend == 'numpy':
+            measurements = sampling.run(circuit, repetitions, seed)
+        else:
+            measurements = cirq.Simulator(seed=seed).run(circuit, repetitions=repetitions).measurements
 
-    # Convert the result to a numpy array
-    matrix = np.empty((repetitions, len(qubits)))
-    for i, measurement in enumerate(result.measurements.values()):
-        for j, bit in enumerate(measurement):
-            matrix[i, j] = bit
+    # One row per qubit, one column per repetition
+    matrix = measurements['beats'].T
 
-    # split into two matrices of 8x16
+    # split into two matrices of 8 x repetitions
     matrix = np.split(matrix, 2)
 
     # create a third matrix where the 1s are only if both matrices have 1s in that position
-    matrix1 = np.multiply(matrix[0], matrix[1])
+    matrix1 = matrix[0] & matrix[1]
 
     # create a fourth matrix where the 1s are only if both matrices have 0s in that position
-    matrix2 = np.multiply(np.subtract(1, matrix[0]), np.subtract(1, matrix[1]))
-    
+    matrix2 = (1 - matrix[0]) & (1 - matrix[1])
 
-    # combine matrix1 and matrix2 into a 8x32 matrix
+    # combine matrix1 and matrix2 into a 8 x (2 * repetitions) matrix
     matrix = np.concatenate((matrix1, matrix2), axis=1)
 
     # convert values in matrix to ints
     matrix = matrix.astype(int)
-    generate_midi(matrix)
+    if midi_file is not None:
+        with trace.span('write', file=midi_file):
+            generate_midi(matrix, midi_file)
     # Return the matrix
     return matrix
 
@@ -100,11 +89,7 @@ def main():
     print(matrix)
     # Save the matrix to a MIDI file
     # write the matrix to a file
-    with open('matrix.txt', 'w') as f:
-        for row in matrix:
-            for column in row:
-                f.write(str(column) + ' ')
-            f.write('\n')
+    np.savetxt('matrix.txt', matrix, fmt='%d')
 
 
 # Call the main function if the script is run directly
@@ -0,0 +1,70 @@
+import cirq
+import numpy as np
+
+def product_state_probabilities(circuit):
+    """Probability of measuring 1 on each qubit of a product-state circuit, or None if it isn't one.
+
+    A product-state circuit starts from |0...0>, applies only single-qubit unitaries and ends in
+    measurements that each qubit gets at most once. Its qubits never interact, so each one is
+    measured independently with the probability its own gates give it.
+    """
+    if not circuit.are_all_measurements_terminal():
+        return None
+
+    unitaries = {}
+    # Measured qubits in the order they are measured, so the same seed always draws the same bits for them
+    measured = {}
+    for op in circuit.all_operations():
+        if cirq.is_measurement(op):
+            if not isinstance(op.gate, cirq.MeasurementGate) or any(qubit in measured for qubit in op.qubits):
+                return None
+            measured.update(dict.fromkeys(op.qubits))
+        elif len(op.qubits) == 1 and cirq.has_unitary(op):
+            unitaries[op.qubits[0]] = cirq.unitary(op) @ unitaries.get(op.qubits[0], np.eye(2))
+        else:
+            return None
+
+    # Starting from |0>, the chance of a 1 is the weight of the second entry of the first column
+    return {qubit: float(np.abs(unitaries[qubit][1, 0]) ** 2) if qubit in unitaries else 0.0 for qubit in measured}
+
+def sample_bits(probabilities, repetitions, rng):
+    """A (repetitions, qubits) int8 array of independent bits, each column 1 with its probability.
+
+    Fair coins, like qubits after a Hadamard, are drawn eight to a random byte.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if np.all(probabilities == 0.5):
+        random_bytes = rng.integers(0, 256, size=(repetitions, (len(probabilities) + 7) // 8), dtype=np.uint8)
+        return np.unpackbits(random_bytes, axis=1, count=len(probabilities)).view(np.int8)
+    return (rng.random((repetitions, len(probabilities))) < probabilities).view(np.int8)
+
+def run(circuit, repetitions, seed=None):
+    """Measurement results of a circuit as {key: (repetitions, qubits) int8 array}, like cirq.Simulator().run().
+
+    Product-state circuits are sampled directly with NumPy; other Clifford circuits fall back to
+    Cirq's stabilizer sampler and anything else to the state-vector simulator. The same seed gives
+    the same bits every time.
+    """
+    rng = np.random.default_rng(seed)
+    probabilities = product_state_probabilities(circuit)
+
+    if probabilities is None:
+        if all(cirq.has_stabilizer_effect(op) for op in circuit.all_operations()):
+            sampler = cirq.StabilizerSampler(seed=int(rng.integers(2 ** 32)))
+        else:
+            sampler = cirq.Simulator(seed=int(rng.integers(2 ** 32)))
+        result = sampler.run(circuit, repetitions=repetitions)
+        return {key: bits.astype(np.int8, copy=False) for key, bits in result.measurements.items()}
+
+    # Draw every measured qubit at once, then hand each key its columns, flipping inverted ones
+    qubits = list(probabilities)
+    column = {qubit: i for i, qubit in enumerate(qubits)}
+    bits = sample_bits([probabilities[qubit] for qubit in qubits], repetitions, rng)
+
+    measurements = {}
+    for op in circuit.all_operations():
+        if cirq.is_measurement(op):
+            key_bits = bits[:, [column[qubit] for qubit in op.qubits]]
+            key_bits ^= np.array(op.gate.full_invert_mask(), dtype=np.int8)
+            measurements[op.gate.key] = key_bits
+    return measurements
@@ -1,121 +1,277 @@
 # Import the necessary libraries
+import argparse
+import functools
+import multiprocessing
 import cirq
 import numpy as np
-import wave
 import os
 import soundfile as sf
 from scipy.fft import fft, ifft
-import matplotlib.pyplot as plt
+from experiments import trace
+from experiments.audio_io import load_audio
+from experiments.render import PREVIEW_WIDTH, render_spectrogram
+from experiments.quantum import mps, statevector
+from experiments.quantum.archive import ArchiveWriter
+from experiments.quantum.circuits import (fourier_encoding_columns, fourier_encoding_parameters, fourier_encoding_resolvers, fourier_encoding_template,
+                                         parameter_resolvers)
+from experiments.quantum.memo import QuantizedCache
 
 # Define a function to read a wave file into a numpy array
-def read_wav_file(filename):
-    with wave.open(filename, 'rb') as wave_file:
-        params = wave_file.getparams()
-        nchannels, sampwidth, framerate, nframes = params[:4]
-
-        str_data = wave_file.readframes(nframes)
-        wave_data = np.frombuffer(str_data, dtype=np.int16)
-        wave_data = wave_data * 1.0 / (max(abs(wave_data)))
+def read_wav_file(filename, mono=True):
+    # Keep the file's own rate and double precision, downmixing to mono unless mono=False
+    wave_data, framerate = load_audio(filename, sr=None, mono=mono, dtype=np.float64)
+    wave_data = wave_data / np.max(np.abs(wave_data))
 
     return wave_data, framerate
 
+# Define a function to interleave the chunks of every channel into one stream of chunks
+def interleave_channels(wave_data, n_qubits):
+    # Chunk i of every channel in turn, then chunk i + 1, dropping each channel's incomplete last chunk
+    n_channels, n_samples = wave_data.shape
+    n_chunks = n_samples // n_qubits
+    chunks = wave_data[:, :n_chunks * n_qubits].reshape(n_channels, n_chunks, n_qubits)
+    return chunks.transpose(1, 0, 2).reshape(-1)
+
 # Define a function to create a quantum circuit that encodes a chunk of Fourier data
 def create_circuit(fft_data_chunk, qubits):
-    print('Creating circuit')
-    circuit = cirq.Circuit()
+    # Fill the shared QFT + encoding template with this chunk's Fourier transform data
+    resolver = fourier_encoding_resolvers(fft_data_chunk)[0]
+    return cirq.resolve_parameters(fourier_encoding_template(tuple(qubits)), resolver)
+
+# Simulation function reused for every chunk handled by this process, whether it yields MPSs, and what each chunk outputs
+simulate_states = None
+simulates_mps = False
+readout = 'amplitudes'
+
+def init_worker(backend='cirq', dtype=np.complex64, max_bond=None, chunk_readout='amplitudes'):
+    global simulate_states, simulates_mps, readout
+    simulates_mps = backend == 'mps'
+    readout = chunk_readout
+    if simulates_mps:
+        simulate_states = functools.partial(mps.simulate_sweep, max_bond=max_bond)
+    else:
+        simulate_states = statevector.sweep_simulator(backend, dtype)
+
+# Define a function to turn rows of circuit parameters into 16-bit PCM through the quantum circuit
+def simulate_parameter_batch(parameters):
+    # Create a list of qubits for the quantum circuit
+    n_qubits = parameters.shape[1] // 2
+    qubits = tuple(cirq.GridQubit(0, j) for j in range(n_qubits))
+
+    # Bind each chunk's Fourier data to the shared circuit template
+    template = fourier_encoding_template(qubits)
+    resolvers = parameter_resolvers(fourier_encoding_columns(n_qubits), parameters)
+
+    trace.count('chunks', len(resolvers))
+    trace.count('simulator_calls')
+
+    # The simulator yields states lazily, so this span covers simulation, inverse transform and normalization
+    pcm_chunks = []
+    truncation_errors = np.zeros(len(resolvers))
+    with trace.span('simulate', chunks=len(resolvers)):
+        for i, simulated_final_state in enumerate(simulate_states(template, resolvers)):
+            if simulates_mps:
+                truncation_errors[i] = simulated_final_state.truncation_error
+                if readout == 'expectation':
+                    # One sample per qubit, its Z expectation, never building the 2**n state vector
+                    simulated_wave_data_chunk = simulated_final_state.expectation_z()
+                    peak = max(abs(simulated_wave_data_chunk))
+                    pcm_chunks.append(np.int16(simulated_wave_data_chunk * (32767 / peak if peak else 0)))
+                    continue
+                simulated_final_state = simulated_final_state.state_vector()
+
+            # Perform Inverse Fourier Transform on the simulated final state to get the simulated wave data chunk
+            simulated_wave_data_chunk = ifft(simulated_final_state)
+
+            # Normalize the simulated wave data chunk to the range [-1, 1]
+            simulated_wave_data_chunk = simulated_wave_data_chunk * 1.0 / (max(abs(simulated_wave_data_chunk)))
+
+            # Convert the simulated wave data chunk to 16-bit PCM
+            pcm_chunks.append(np.int16(simulated_wave_data_chunk * 32767))
+
+    return pcm_chunks, truncation_errors
+
+# Define a function to turn a batch of wave data chunks into circuit parameters and 16-bit PCM through the quantum circuit
+def simulate_batch(wave_data_chunks):
+    # Perform Fourier Transform on each wave data chunk
+    fft_data_chunks = fft(wave_data_chunks, axis=-1)
+
+    parameters = fourier_encoding_parameters(fft_data_chunks)
+    return (parameters,) + simulate_parameter_batch(parameters)
+
+def simulate_cached(imap, wave_data, n_qubits, batch_size, archive, cache, window, truncation_errors):
+    """Yields the PCM of every chunk through cache, simulating only its misses with imap, window chunks at a time.
 
-    # Apply QFT
-    for i, _ in enumerate(qubits):
-        for j in range(i):
-            circuit.append(cirq.CZPowGate(exponent=-1/2**(i - j))(qubits[i], qubits[j]))
-        circuit.append(cirq.H(qubits[i]))
-    for i in range(len(qubits) // 2):
-        circuit.append(cirq.SWAP(qubits[i], qubits[-i-1]))
+    The truncation error of every simulated miss is appended to truncation_errors.
+    """
+    n_chunks = len(wave_data) // n_qubits
+    for start in range(0, n_chunks, window):
+        wave_data_chunks = wave_data[start * n_qubits:min(start + window, n_chunks) * n_qubits].reshape(-1, n_qubits)
+        parameters = fourier_encoding_parameters(fft(wave_data_chunks, axis=-1))
 
-    # Encode the Fourier transform data
-    for i, fft_coefficient in enumerate(fft_data_chunk):
-        magnitude = np.abs(fft_coefficient)
-        phase = np.angle(fft_coefficient)
-        circuit.append(cirq.rz(magnitude)(qubits[i]))
-        circuit.append(cirq.rx(phase)(qubits[i]))
+        # Simulate the rounded parameters the cache doesn't have yet, batch_size chunks per task
+        def simulate_misses(missing):
+            batches = (missing[i:i + batch_size] for i in range(0, len(missing), batch_size))
+            outputs = []
+            for pcm_chunks, errors in imap(simulate_parameter_batch, batches):
+                outputs += pcm_chunks
+                truncation_errors.extend(errors)
+            return outputs
 
-    return circuit
+        with trace.span('cache_lookup', chunks=len(parameters)):
+            pcm_chunks, quantized = cache.lookup(parameters, simulate_misses)
 
-# Read the wave data from the file
-wave_data, framerate = read_wav_file('kick.wav')
+        # Archive the rounded parameters, which are the circuits the PCM actually came from
+        if archive is not None:
+            archive.append(quantized)
+        yield from pcm_chunks
 
-# Define the number of qubits in each circuit
-n_qubits = 16
+def check_readout(backend, readout):
+    """Raises ValueError unless readout is 'amplitudes', or 'expectation' with the mps backend."""
+    if readout not in ('amplitudes', 'expectation'):
+        raise ValueError(f"Unknown readout {readout!r}, expected 'amplitudes' or 'expectation'")
+    if readout == 'expectation' and backend != 'mps':
+        raise ValueError("The expectation readout needs the mps backend")
 
-# Set the max samples
-MAX_SAMPLES = 1000
+def simulate_chunks(wave_data, n_qubits, workers=None, batch_size=8, backend='cirq', dtype=np.complex64, archive=None, cache=None, max_bond=None,
+                    readout='amplitudes', truncation_errors=None):
+    """Yields the PCM of every chunk in input order, sweeping batches of chunks through worker processes.
 
-# Take only the first MAX_SAMPLES from the wave data
-wave_data = wave_data[:MAX_SAMPLES]
+    backend is 'cirq', 'numpy' (the in-house state-vector kernel) or 'mps' (the matrix product state
+    kernel, keeping at most max_bond singular values per bond), dtype complex64 or complex128.
+    readout='amplitudes' outputs the inverse FFT of the 2**n_qubits amplitudes of every chunk's state;
+    readout='expectation' (mps only) outputs the n_qubits Z expectations instead, so chunks of 64
+    samples never build their state vectors. The truncation error of every chunk simulated is
+    appended to truncation_errors, a list, if given (0 for the state-vector backends).
+    The circuit parameters of every chunk are appended to archive, an ArchiveWriter, if one is given.
+    With a memo.QuantizedCache, chunks are simulated at their rounded parameters, and only those the
+    cache doesn't hold yet; repeated chunks, as in drum loops, are then looked up.
+    """
+    n_chunks = len(wave_data) // n_qubits
+    batches = (wave_data[start * n_qubits:min(start + batch_size, n_chunks) * n_qubits].reshape(-1, n_qubits)
+               for start in range(0, n_chunks, batch_size))
 
-# Create a list of qubits for the quantum circuit
-qubits = [cirq.GridQubit(0, i) for i in range(n_qubits)]
+    # Look chunks up a few batches per worker at a time, so misses still keep every worker busy
+    window = batch_size * 4 * (workers or os.cpu_count() or 1)
 
-# Determine the number of chunks
-n_chunks = len(wave_data) // n_qubits
+    check_readout(backend, readout)
+    if truncation_errors is None:
+        truncation_errors = []
 
-# Make sure /data directory exists
-if not os.path.exists('data'):
-    os.makedirs('data')
+    if workers == 1:
+        init_worker(backend, dtype, max_bond, readout)
+        if cache is not None:
+            yield from simulate_cached(map, wave_data, n_qubits, batch_size, archive, cache, window, truncation_errors)
+            return
+        for parameters, pcm_chunks, errors in map(simulate_batch, batches):
+            if archive is not None:
+                archive.append(parameters)
+            truncation_errors.extend(errors)
+            yield from pcm_chunks
+        return
 
-# Create a .wav file to hold the output
-outfile = sf.SoundFile('output.wav', 'w', samplerate=framerate, channels=1, subtype='PCM_16')
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(backend, dtype, max_bond, readout)) as pool:
+        if cache is not None:
+            yield from simulate_cached(pool.imap, wave_data, n_qubits, batch_size, archive, cache, window, truncation_errors)
+            return
+        for parameters, pcm_chunks, errors in pool.imap(simulate_batch, batches):
+            if archive is not None:
+                archive.append(parameters)
+            truncation_errors.extend(errors)
+            yield from pcm_chunks
 
-# Initialize an empty list to hold the output data for spectrogram
-output_data = []
+def process_audio(input_file, output_file, n_qubits=16, max_samples=None, workers=None, batch_size=8, backend='cirq', dtype=np.complex64,
+                  archive_file=os.path.join('data', 'circuits.qca'), spectrogram_files=('input_spectrogram.png', 'output_spectrogram.png'), cache=None,
+                  mono=True, max_bond=None, readout='amplitudes'):
+    """Encodes every n_qubits-sample chunk of the input into a circuit, simulates it and writes the result as 16-bit PCM.
 
-# Iterate over each chunk
-for i in range(n_chunks):
-    # Get the wave data chunk
-    wave_data_chunk = wave_data[i * n_qubits: (i + 1) * n_qubits]
+    mono=False keeps every channel: the chunks of all channels are interleaved into one stream, so
+    they are swept through the same workers and cache, and archived in that order with the number
+    of channels in the archive's metadata.
 
-    # Perform Fourier Transform on the wave data chunk
-    fft_data_chunk = fft(wave_data_chunk)
+    backend='mps' simulates matrix product states of at most max_bond singular values per bond and
+    prints the truncation error that cost; with readout='expectation' each chunk outputs its
+    n_qubits Z expectations rather than 2**n_qubits samples (see simulate_chunks).
+    """
+    # Refuse a readout the backend can't give before any output file is created
+    check_readout(backend, readout)
 
-    # Create a quantum circuit for the FFT data chunk
-    circuit = create_circuit(fft_data_chunk, qubits)
+    with trace.span('quantum_script.process_audio', file=input_file):
+        # Read the wave data from the file
+        wave_data, framerate = read_wav_file(input_file, mono)
 
-    # Save the circuit as a .json file
-    cirq.to_json(circuit, f'data/circuit_{i}.json')
+        # Take only the first max_samples of every channel from the wave data
+        if max_samples is not None:
+            wave_data = wave_data[..., :max_samples]
 
-    # Simulate the quantum circuit
-    simulator = cirq.Simulator()
-    result = simulator.simulate(circuit)
-    simulated_final_state = result.final_state_vector
+        # Every channel's chunk i is simulated next to the others, in one stream of chunks
+        n_channels = 1 if wave_data.ndim == 1 else len(wave_data)
+        chunk_stream = wave_data if wave_data.ndim == 1 else interleave_channels(wave_data, n_qubits)
 
-    # Perform Inverse Fourier Transform on the simulated final state to get the simulated wave data chunk
-    simulated_wave_data_chunk = ifft(simulated_final_state)
+        # Make sure the archive's directory exists
+        os.makedirs(os.path.dirname(archive_file) or '.', exist_ok=True)
 
-    # Normalize the simulated wave data chunk to the range [-1, 1]
-    simulated_wave_data_chunk = simulated_wave_data_chunk * 1.0 / (max(abs(simulated_wave_data_chunk)))
+        # Save the circuit template once and every chunk's parameters as a row of one archive (see archive.py)
+        template = fourier_encoding_template(tuple(cirq.GridQubit(0, j) for j in range(n_qubits)))
+        metadata = {'input': input_file, 'sample_rate': framerate, 'chunk_size': n_qubits, 'channels': n_channels, 'readout': readout}
 
-    # Convert the simulated wave data chunk to 16-bit PCM
-    simulated_wave_data_chunk_pcm = np.int16(simulated_wave_data_chunk * 32767)
+        # Create a .wav file to hold the output
+        with ArchiveWriter(archive_file, template, fourier_encoding_columns(n_qubits), metadata=metadata) as archive, \
+                sf.SoundFile(output_file, 'w', samplerate=framerate, channels=n_channels, subtype='PCM_16') as outfile:
+            frame_chunks = []
+            truncation_errors = []
+            for simulated_wave_data_chunk_pcm in simulate_chunks(chunk_stream, n_qubits, workers, batch_size, backend, dtype, archive, cache, max_bond,
+                                                                 readout, truncation_errors):
+                # Write the simulated wave data chunk to the .wav file, once every channel's chunk is in
+                frame_chunks.append(simulated_wave_data_chunk_pcm)
+                if len(frame_chunks) == n_channels:
+                    outfile.write(np.stack(frame_chunks, axis=1))
+                    frame_chunks = []
 
-    # Append the simulated wave data chunk to the output data
-    output_data.extend(simulated_wave_data_chunk_pcm)
+        # Create spectrograms of the input and output, each its own image, unless they were turned off.
+        # The output is memory-mapped back from the file instead of being kept in memory while simulating
+        if spectrogram_files is not None:
+            render_spectrogram(wave_data, spectrogram_files[0], width=PREVIEW_WIDTH)
+            output_data, _ = load_audio(output_file, sr=None, mono=mono, dtype=np.int16, mmap=True)
+            render_spectrogram(output_data, spectrogram_files[1], width=PREVIEW_WIDTH)
 
-    # Write the simulated wave data chunk to the .wav file
-    outfile.write(simulated_wave_data_chunk_pcm)
+        # Report how much fidelity the bond dimension cap cost
+        if backend == 'mps' and truncation_errors:
+            print('MPS truncation error:', {'max': float(np.max(truncation_errors)), 'mean': float(np.mean(truncation_errors))})
 
-# Close the .wav file
-outfile.close()
+        # Report how well the cache did, and keep it for the next run
+        if cache is not None:
+            print('Cache:', cache.stats())
+            if cache.cache_file is not None:
+                cache.save()
 
-# Convert output data to numpy array
-output_data = np.array(output_data)
+    print('Finished')
 
-# Create spectrograms
-plt.specgram(wave_data, Fs=framerate)
-plt.title('Input Spectrogram')
-plt.savefig('input_spectrogram.png')
+# Command-line arguments parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode audio chunks into quantum circuits and simulate them back to audio.")
+    parser.add_argument('--input', type=str, default='kick.wav', help='Path to input file')
+    parser.add_argument('--output', type=str, default='output.wav', help='Path to output file')
+    parser.add_argument('--n_qubits', type=int, default=16, help='Samples per chunk, one qubit each')
+    parser.add_argument('--max_samples', type=int, default=None, help='Only process the first max_samples samples (default: all)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--batch_size', type=int, default=8, help='Number of chunks simulated as one parameter sweep by a worker')
+    parser.add_argument('--backend', type=str, default='cirq', choices=['cirq', 'numpy', 'mps'], help='Simulate with Cirq, the in-house NumPy state-vector kernel or the MPS kernel')
+    parser.add_argument('--max_bond', type=int, default=None, help='Bond dimension cap of the mps backend (default: exact)')
+    parser.add_argument('--readout', type=str, default='amplitudes', choices=['amplitudes', 'expectation'],
+                        help="Output the inverse FFT of each chunk's 2**n amplitudes, or (mps only) its n Z expectations")
+    parser.add_argument('--precision', type=str, default='complex64', choices=['complex64', 'complex128'], help='Precision of the simulated state vector')
+    parser.add_argument('--archive', type=str, default=os.path.join('data', 'circuits.qca'), help='Path to write the circuit archive to')
+    parser.add_argument('--cache_resolution', type=float, default=None, help='Round circuit angles to this resolution and simulate each rounded circuit once (default: no cache)')
+    parser.add_argument('--cache_size', type=int, default=256, help='Number of simulated chunks the cache keeps')
+    parser.add_argument('--cache_file', type=str, default=None, help='File to load the cache from and save it to')
+    parser.add_argument('--multichannel', action='store_true', help='Keep every channel instead of downmixing to mono')
+    args = parser.parse_args()
 
-plt.specgram(output_data, Fs=framerate)
-plt.title('Output Spectrogram')
-plt.savefig('output_spectrogram.png')
+    cache = None
+    if args.cache_resolution is not None:
+        cache = QuantizedCache(args.cache_resolution, args.cache_size, args.cache_file)
 
-print('Finished')
+    process_audio(args.input, args.output, n_qubits=args.n_qubits, max_samples=args.max_samples, workers=args.workers, batch_size=args.batch_size,
+                  backend=args.backend, dtype=np.dtype(args.precision).type, archive_file=args.archive, cache=cache, mono=not args.multichannel,
+                  max_bond=args.max_bond, readout=args.readout)
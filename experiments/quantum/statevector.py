@@ -0,0 +1,218 @@
+import functools
+import cirq
+import numpy as np
+
+# Instructions understood by the kernel, compiled once per circuit
+DIAGONAL, MATRIX, SWAP, UNITARY = range(4)
+
+HADAMARD = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+
+def _view(n_qubits, axes, bits):
+    """Shape and index selecting the given bits of the given qubits from a flat state.
+
+    The state is reshaped so that each target qubit is its own axis of length 2 and every run of
+    untouched qubits is folded into one axis, which keeps NumPy's strided loops long.
+    """
+    shape = []
+    index = []
+    previous = -1
+    for axis, bit in sorted(zip(axes, bits)):
+        shape += [2 ** (axis - previous - 1), 2]
+        index += [slice(None), bit]
+        previous = axis
+    shape.append(2 ** (n_qubits - previous - 1))
+    index.append(slice(None))
+    return tuple(shape), tuple(index)
+
+def compile_circuit(circuit, qubit_order=cirq.QubitOrder.DEFAULT):
+    """Compiles a circuit into a list of (kind, gates, views, trivial_on_zero) instructions for run().
+
+    Qubits are ordered like cirq.Simulator orders them, so states match Cirq's big-endian layout.
+    Consecutive single-qubit gates on a qubit are fused into one 2x2 matrix, and gates acting on
+    qubits that are still |0> are marked so run() can shortcut them when starting from |0...0>.
+    Raises ValueError for operations without a unitary (measurements, channels).
+    """
+    qubits = cirq.QubitOrder.as_qubit_order(qubit_order).order_for(circuit.all_qubits())
+    n_qubits = len(qubits)
+    axis = {qubit: i for i, qubit in enumerate(qubits)}
+
+    instructions = []
+    pending = {}
+    touched = set()
+
+    def flush(i):
+        gates = pending.pop(i, None)
+        if gates:
+            views = [_view(n_qubits, (i,), (0,)), _view(n_qubits, (i,), (1,))]
+            instructions.append((MATRIX, gates, views, i not in touched))
+            if not all(isinstance(gate, cirq.ZPowGate) for gate in gates):
+                touched.add(i)
+
+    for op in circuit.all_operations():
+        gate = op.gate
+        axes = tuple(axis[qubit] for qubit in op.qubits)
+        if not cirq.has_unitary(op) and not cirq.is_parameterized(op):
+            raise ValueError(f'Operation {op!r} has no unitary and cannot be simulated by the state-vector kernel')
+
+        # Single-qubit gates commute with everything on other qubits, so collect them until needed
+        if len(axes) == 1:
+            pending.setdefault(axes[0], []).append(gate)
+            continue
+        for i in axes:
+            flush(i)
+
+        if isinstance(gate, cirq.CZPowGate):
+            trivial_on_zero = not touched.issuperset(axes)
+            instructions.append((DIAGONAL, [gate], [_view(n_qubits, axes, (1, 1))], trivial_on_zero))
+        elif gate == cirq.SWAP:
+            trivial_on_zero = not touched.intersection(axes)
+            views = [_view(n_qubits, axes, (0, 1)), _view(n_qubits, axes, (1, 0))]
+            instructions.append((SWAP, [gate], views, trivial_on_zero))
+            if len(touched.intersection(axes)) == 1:
+                touched.symmetric_difference_update(axes)
+        else:
+            instructions.append((UNITARY, [gate], axes, False))
+            touched.update(axes)
+
+    for i in sorted(pending):
+        flush(i)
+    return n_qubits, instructions
+
+def _value(gate, resolver):
+    """Exponent and global shift of an EigenGate, resolving symbols if needed."""
+    exponent = gate.exponent
+    if cirq.is_parameterized(exponent):
+        exponent = resolver.value_of(exponent)
+    return float(exponent), gate.global_shift
+
+def _matrix(gate, resolver):
+    """2x2 unitary of a single-qubit gate, computed directly for the gates the kernel knows."""
+    if gate == cirq.H:
+        return HADAMARD
+    if isinstance(gate, cirq.XPowGate):
+        exponent, global_shift = _value(gate, resolver)
+        half_angle = np.pi * exponent / 2
+        return np.exp(1j * np.pi * exponent * (global_shift + 0.5)) * np.array(
+            [[np.cos(half_angle), -1j * np.sin(half_angle)],
+             [-1j * np.sin(half_angle), np.cos(half_angle)]])
+    if isinstance(gate, cirq.ZPowGate):
+        exponent, global_shift = _value(gate, resolver)
+        return np.diag([np.exp(1j * np.pi * exponent * global_shift), np.exp(1j * np.pi * exponent * (global_shift + 1))])
+    return cirq.unitary(cirq.resolve_parameters(gate, resolver))
+
+def run(compiled, resolver=None, dtype=np.complex64, initial_state=None, out=None, scratch=None):
+    """Applies compiled instructions to a state buffer in place and returns it as a flat vector.
+
+    out (2**n_qubits entries) and scratch (2**n_qubits entries) are optional preallocated buffers,
+    reused between runs so a sweep allocates nothing per circuit.
+    """
+    n_qubits, instructions = compiled
+    resolver = cirq.ParamResolver(resolver)
+
+    if out is None:
+        out = np.empty(2 ** n_qubits, dtype=dtype)
+    if initial_state is None:
+        out[:] = 0
+        out[0] = 1
+    else:
+        out[:] = initial_state
+
+    # Scratch space for one half of the state, shared by all single-qubit matrices and swaps
+    if scratch is None:
+        scratch = np.empty(2 ** n_qubits, dtype=out.dtype)
+    scratch = scratch.reshape(2, -1)
+
+    for kind, gates, views, trivial_on_zero in instructions:
+        if kind == DIAGONAL:
+            # Controlled phases only scale the amplitudes where every target bit is 1
+            exponent, global_shift = _value(gates[0], resolver)
+            if global_shift:
+                out *= out.dtype.type(np.exp(1j * np.pi * exponent * global_shift))
+            if not (trivial_on_zero and initial_state is None):
+                shape, index = views[0]
+                out.reshape(shape)[index] *= out.dtype.type(np.exp(1j * np.pi * exponent))
+
+        elif kind == MATRIX:
+            u = np.eye(2)
+            for gate in gates:
+                u = _matrix(gate, resolver) @ u
+            # Keep the arithmetic in the buffer's precision
+            u = u.astype(out.dtype)
+
+            (shape, index0), (_, index1) = views
+            state = out.reshape(shape)
+            s0 = state[index0]
+            s1 = state[index1]
+            if u[0, 1] == 0 and u[1, 0] == 0:
+                s0 *= u[0, 0]
+                s1 *= u[1, 1]
+                continue
+            if trivial_on_zero and initial_state is None:
+                # The qubit is still |0>, so only the first column of the matrix matters
+                np.multiply(s0, u[1, 0], out=s1)
+                s0 *= u[0, 0]
+                continue
+
+            tmp0 = scratch[0].reshape(s0.shape)
+            tmp1 = scratch[1].reshape(s0.shape)
+            np.copyto(tmp0, s0)
+            np.multiply(s0, u[0, 0], out=s0)
+            np.multiply(s1, u[0, 1], out=tmp1)
+            s0 += tmp1
+            np.multiply(s1, u[1, 1], out=s1)
+            np.multiply(tmp0, u[1, 0], out=tmp1)
+            s1 += tmp1
+
+        elif kind == SWAP:
+            if trivial_on_zero and initial_state is None:
+                continue
+            (shape, index01), (_, index10) = views
+            state = out.reshape(shape)
+            s01 = state[index01]
+            s10 = state[index10]
+            tmp = scratch[0, :s01.size].reshape(s01.shape)
+            np.copyto(tmp, s01)
+            np.copyto(s01, s10)
+            np.copyto(s10, tmp)
+
+        else:
+            # Anything else falls back to Cirq's unitary for the gate, still applied to our buffer
+            state = out.reshape((2,) * n_qubits)
+            u = cirq.unitary(cirq.resolve_parameters(gates[0], resolver)).reshape((2,) * 2 * len(views))
+            state[...] = cirq.linalg.targeted_left_multiply(u, state, views)
+
+    return out
+
+def simulate(circuit, resolver=None, dtype=np.complex64, qubit_order=cirq.QubitOrder.DEFAULT, initial_state=None):
+    """Final state vector of a unitary circuit, like cirq.Simulator().simulate(...).final_state_vector."""
+    return run(compile_circuit(circuit, qubit_order), resolver, dtype, initial_state)
+
+def simulate_sweep(circuit, resolvers, dtype=np.complex64, qubit_order=cirq.QubitOrder.DEFAULT):
+    """Yields the final state vector for every resolver, compiling the circuit once.
+
+    The yielded array is a buffer reused for the next resolver, so copy it to keep it.
+    """
+    compiled = compile_circuit(circuit, qubit_order)
+    out = np.empty(2 ** compiled[0], dtype=dtype)
+    scratch = np.empty_like(out)
+    for resolver in resolvers:
+        yield run(compiled, resolver, out=out, scratch=scratch)
+
+def sweep_simulator(backend='cirq', dtype=np.complex64):
+    """A function (circuit, resolvers) yielding final state vectors, simulating with Cirq or with this kernel.
+
+    backend is 'cirq' or 'numpy'. The kernel reuses one buffer for every state, so copy them to keep them.
+    """
+    if backend == 'numpy':
+        return functools.partial(simulate_sweep, dtype=dtype)
+    simulator = cirq.Simulator(dtype=dtype)
+    return lambda circuit, resolvers: (result.final_state_vector for result in simulator.simulate_sweep_iter(circuit, resolvers))
+
+def check_against_cirq(circuit, resolver=None, dtype=np.complex64, atol=1e-5):
+    """Raises AssertionError if the kernel's final state differs from Cirq's, returning the max difference."""
+    expected = cirq.Simulator(dtype=dtype).simulate(circuit, resolver).final_state_vector
+    actual = simulate(circuit, resolver, dtype)
+    difference = np.max(np.abs(actual - expected))
+    if difference > atol:
+        raise AssertionError(f'State-vector kernel differs from Cirq by {difference:.3g} (atol {atol:.3g})')
+    return difference
@@ -1,66 +1,127 @@
 import numpy as np
-import scipy.io.wavfile
-import scipy.signal
-import librosa
 import soundfile as sf
-import cirq
+from experiments import derivative, trace
+from experiments.audio_io import load_audio
+
+def rx_matrices(angles):
+    """Stack of rx(angle) unitaries, one 2x2 matrix per angle."""
+    cos = np.cos(angles / 2)
+    sin = -1j * np.sin(angles / 2)
+    return np.stack([np.stack([cos, sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=-2)
+
+def rz_matrices(angles):
+    """Stack of rz(angle) unitaries, one 2x2 matrix per angle."""
+    zeros = np.zeros_like(angles, dtype=np.complex128)
+    return np.stack([np.stack([np.exp(-0.5j * angles), zeros], axis=-1),
+                     np.stack([zeros, np.exp(0.5j * angles)], axis=-1)], axis=-2)
+
+def simulate_frames(rx_angles, rz_angles):
+    """Z expectation of rz(rz_angle) rx(rx_angle) |0> for all frames in one batched product."""
+    trace.count('simulator_calls')
+    unitaries = rz_matrices(rz_angles) @ rx_matrices(rx_angles)
+
+    # Starting from |0>, the final state is the first column of each unitary
+    probabilities = np.abs(unitaries[..., :, 0]) ** 2
+    return probabilities[..., 0] - probabilities[..., 1]
+
+def simulate_frames_cirq(rx_angles, rz_angles):
+    """Reference implementation running one Cirq simulation per frame."""
+    import cirq
+    q = cirq.GridQubit(0, 0)
+    simulator = cirq.Simulator()
 
-def process_audio(input_file, output_file):
-    # Load audio file and convert to mono
-    y, sr = librosa.load(input_file, sr=None, mono=True)
+    z_expectation = np.empty(len(rx_angles))
+    for i, (rx_angle, rz_angle) in enumerate(zip(rx_angles, rz_angles)):
+        circuit = cirq.Circuit()
+        circuit.append(cirq.rx(rx_angle)(q))
+        circuit.append(cirq.rz(rz_angle)(q))
 
-    # Resample to 44.1kHz if necessary
-    if sr != 44100:
-        y = librosa.resample(y, sr, 44100)
-        sr = 44100
+        result = simulator.simulate(circuit)
+        trace.count('simulator_calls')
+        z_expectation[i] = cirq.Z(q).expectation_from_state_vector(result.final_state_vector, {q: 0}).real
+
+    return z_expectation
+
+FRAME_BACKENDS = {
+    'numpy': simulate_frames,
+    'cirq': simulate_frames_cirq,
+}
+
+def quantum_reconstruct(backend='numpy', cache=None):
+    """A reconstruct step like derivative.reconstruct that scales every frame by its quantum circuit.
+
+    Each frame's circuit is parameterized by its mean amplitude and phase derivative, and the Z
+    expectation it measures scales the amplitude, summed over frequency. Frames are independent, so
+    it works on a whole STFT or frame by frame (see stft.RealtimeDerivativeEffect), and on
+    (channels, bins, frames) derivatives, every channel's frames simulated in the same batch. With a
+    memo.QuantizedCache, frames are simulated at their rounded angles, each pair of them once.
+    """
+    simulate = FRAME_BACKENDS[backend]
+    if cache is not None:
+        simulate_angles = simulate
+
+        def simulate(rx_angles, rz_angles):
+            angles = np.stack([rx_angles, rz_angles], axis=-1)
+            z_expectation, _ = cache.lookup(angles, lambda rows: simulate_angles(rows[:, 0], rows[:, 1]))
+            return z_expectation
+
+    def reconstruct(amplitude_derivative, phase_derivative, state, out=None):
+        trace.count('frames', amplitude_derivative[..., 0, :].size)
+
+        # Evaluate the quantum circuit of every frame, parameterized by mean amplitude and phase derivative
+        rx_angles = np.mean(amplitude_derivative, axis=-2)
+        rz_angles = np.mean(phase_derivative, axis=-2)
+        with trace.span('simulate', frames=rx_angles.size):
+            z_expectation = simulate(rx_angles.ravel(), rz_angles.ravel()).reshape(rx_angles.shape)
+
+        # Use the expectation value of the Z measurement to scale the amplitude, summed over frequency, in place
+        amplitude_reconstructed = np.cumsum(amplitude_derivative, axis=-2, out=amplitude_derivative)
+        amplitude_reconstructed *= z_expectation[..., np.newaxis, :]
+
+        # Reconstruct phase from phase derivative, and the STFT from the reconstructed amplitude and phase
+        phase_reconstructed = phase_derivative
+        derivative.integrate(phase_derivative.reshape(-1, phase_derivative.shape[-1]), state.phase_sum)
+        return derivative.combine(amplitude_reconstructed, phase_reconstructed, out), state
+
+    return reconstruct
+
+def quantum_effect(y, sr, backend='numpy', cache=None):
+    """stft.derivative_effect with every frame scaled by its quantum circuit (see quantum_reconstruct)."""
+    import scipy.signal
 
     # Define STFT parameters
     window_length = int(sr * .01)  # 10ms window
     window_hop = window_length // 2  # 50% overlap
 
     # Compute STFT
-    f, t, stft = scipy.signal.stft(y, sr, nperseg=window_length, noverlap=window_hop)
+    with trace.span('transform'):
+        f, t, stft = scipy.signal.stft(y, sr, nperseg=window_length, noverlap=window_hop)
 
-    # Compute amplitude and phase
-    amplitude = np.abs(stft)
-    phase = np.angle(stft)
-
-    # Compute their derivatives
-    amplitude_derivative = np.diff(amplitude, axis=-1) / (t[1] - t[0])
-    phase_derivative = np.diff(np.unwrap(phase), axis=-1) / (t[1] - t[0])
-
-    # Initialize quantum circuit and simulator
-    q = cirq.GridQubit(0, 0)
-    simulator = cirq.Simulator()
+    # Rebuild the STFT from the derivatives of its amplitude and phase, each frame scaled by its circuit;
+    # the first frame's derivatives are zero, so its amplitude is too
+    with trace.span('derivative'):
+        amplitude_derivative, phase_derivative, state = derivative.decompose(stft.reshape(-1, stft.shape[-1]), t[1] - t[0])
+        amplitude_derivative = amplitude_derivative.reshape(stft.shape)
+        phase_derivative = phase_derivative.reshape(stft.shape)
+    stft_reconstructed, _ = quantum_reconstruct(backend, cache)(amplitude_derivative, phase_derivative, state)
 
-    # Initialize reconstructed amplitude array
-    amplitude_reconstructed = np.zeros_like(amplitude)
-
-    # Process each frame of the STFT
-    for i in range(amplitude.shape[1] - 1):  # -1 due to diff operation
-        # Construct a quantum circuit parameterized by mean amplitude and phase derivative
-        circuit = cirq.Circuit()
-        circuit.append(cirq.rx(np.mean(amplitude_derivative[:, i]))(q))
-        circuit.append(cirq.rz(np.mean(phase_derivative[:, i]))(q))
-
-        # Simulate the circuit
-        result = simulator.simulate(circuit)
-
-        # Use the expectation value of the Z measurement to scale the reconstructed amplitude
-        z_expectation = cirq.Z(q).expectation_from_state_vector(result.final_state_vector, {q: 0}).real
-        amplitude_reconstructed[:, i+1] = z_expectation * np.cumsum(amplitude_derivative[:, i])
+    # Compute the inverse STFT
+    with trace.span('inverse'):
+        t, y_reconstructed = scipy.signal.istft(stft_reconstructed, sr, nperseg=window_length, noverlap=window_hop)
 
-    # Reconstruct phase from phase derivative
-    phase_reconstructed = np.cumsum(np.pad(phase_derivative, ((0, 0), (1, 0))), axis=-1)
+    return y_reconstructed
 
-    # Construct the STFT from the reconstructed amplitude and phase
-    stft_reconstructed = amplitude_reconstructed * np.exp(1j * phase_reconstructed)
+def process_audio(input_file, output_file, backend='numpy', cache=None, mono=True):
+    with trace.span('stft_quantum.process_audio', file=input_file):
+        # Load audio at 44.1kHz
+        y, sr = load_audio(input_file, sr=44100, mono=mono)
 
-    # Compute the inverse STFT
-    t, y_reconstructed = scipy.signal.istft(stft_reconstructed, sr, nperseg=window_length, noverlap=window_hop)
+        y_reconstructed = quantum_effect(y, sr, backend, cache)
 
-    # Write to output file
-    sf.write(output_file, y_reconstructed, sr)
+        # Write to output file, one column per channel
+        with trace.span('write'):
+            sf.write(output_file, y_reconstructed.T, sr)
 
 # Test the function
-process_audio('input.wav', 'output_quantum.wav')
+if __name__ == "__main__":
+    process_audio('input.wav', 'output_quantum.wav')
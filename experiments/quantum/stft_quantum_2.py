@@ -1,78 +1,126 @@
-import librosa
+import functools
 import numpy as np
 import cirq
 import soundfile as sf
 from scipy import fftpack
+from experiments import trace
+from experiments.audio_io import load_audio
+from experiments.quantum import mps
+from experiments.quantum.circuits import qft, qft_unitary
+from experiments.quantum.encoding import amplitude_states, n_qubits_for, prepare_state
 
 # Define window parameters
 window_length = 200  # 10ms window assuming 20kHz sample rate
 window_hop = window_length // 2  # 50% overlap
 
-def qft(n_qubits):
-    """Constructs the QFT on the given number of qubits."""
-    qubits = cirq.LineQubit.range(n_qubits)
-    circuit = cirq.Circuit()
-    for i in range(n_qubits):
-        for j in range(i):
-            circuit.append(cirq.CZPowGate(exponent=2 ** (j - i)).on(qubits[i], qubits[j]))
-        circuit.append(cirq.H(qubits[i]))
-    return circuit, qubits
-
 def encode_amplitudes(amplitudes):
-    """Encodes the given amplitudes into a quantum state."""
-    n_qubits = len(amplitudes)
-    qubits = cirq.LineQubit.range(n_qubits)
-    sqrt_amplitudes = np.sqrt(amplitudes)
-
-    # The list of quantum operations that prepare the desired state
-    operations = []
-    for i, sqrt_amplitude in enumerate(sqrt_amplitudes):
-        # Convert to binary
-        bin_i = format(i, '0' + str(n_qubits) + 'b')
-        # Apply X gate if the corresponding binary digit is 1
-        operations += [cirq.X(qubits[j]) for j in range(n_qubits) if bin_i[j] == '1']
-        # Apply amplitude damping channel
-        operations.append(cirq.amplitude_damp(sqrt_amplitude)(qubits[0]))
-        # Uncompute the X gates
-        operations += [cirq.X(qubits[j]) for j in range(n_qubits) if bin_i[j] == '1']
-    return operations, qubits
-
-def process_audio(input_file, output_file):
-    # Load audio file and convert to mono
-    y, sr = librosa.load(input_file, sr=None, mono=True)
-
-    # Resample to 2kHz if necessary
-    if sr != 2000:
-        y = librosa.resample(y, sr, 2000)
-
-    # Initialize reconstructed y array
-    y_reconstructed = np.zeros_like(y)
-
-    # Simulate each frame of the window
-    for i in range(0, len(y), window_hop):
-        print('Processing frame', i)
-        window = y[i:i + window_length]
-        if len(window) < window_length:
-            window = np.pad(window, (0, window_length - len(window)))  # Pad last frame if necessary
-        amplitudes = np.abs(window)
-
-        encode_operations, encode_qubits = encode_amplitudes(amplitudes)
-        qft_circuit, qft_qubits = qft(len(encode_qubits))
+    """Encodes the given amplitudes into a quantum state on ceil(log2(len(amplitudes))) qubits.
+
+    The state's probabilities are the amplitudes, normalized. Returns the preparation operations, the
+    qubits and the state they prepare.
+    """
+    qubits = cirq.LineQubit.range(n_qubits_for(len(amplitudes)))
+    state = amplitude_states(np.sqrt(amplitudes), len(qubits))[0]
+    return prepare_state(state, qubits), qubits, state
+
+def simulate_frames(frames):
+    """Final states of the QFT of every frame's encoded state, in one batched product.
+
+    The encoded states are used as they are instead of being prepared by gates, and the QFT is applied
+    as its cached unitary.
+    """
+    trace.count('simulator_calls')
+    qubits = tuple(cirq.LineQubit.range(n_qubits_for(frames.shape[1])))
+    states = amplitude_states(np.sqrt(frames), len(qubits))
+    return states @ qft_unitary(qubits).T
+
+def simulate_frames_cirq(frames):
+    """Reference implementation simulating the full preparation and QFT circuit of each frame with Cirq."""
+    simulator = cirq.Simulator(dtype=np.complex128)
+    final_states = []
+    for amplitudes in frames:
+        encode_operations, encode_qubits, _ = encode_amplitudes(amplitudes)
         circuit = cirq.Circuit()
         circuit.append(encode_operations)
-        circuit.append(qft_circuit)
+        circuit.append(qft(tuple(encode_qubits)))
+
+        result = simulator.simulate(circuit, qubit_order=encode_qubits)
+        trace.count('simulator_calls')
+        final_states.append(result.final_state_vector)
+    return np.array(final_states)
+
+def simulate_frames_mps(frames, max_bond=None, truncation_errors=None):
+    """Final states of the QFT of every frame's encoded state, simulated as matrix product states.
+
+    Each encoded state is split into an MPS and the QFT gates applied to it, keeping at most max_bond
+    singular values per bond, so memory grows with the window length rather than its square as the
+    numpy backend's unitary does. Each frame's truncation error goes into truncation_errors if given.
+    """
+    qubits = tuple(cirq.LineQubit.range(n_qubits_for(frames.shape[1])))
+    compiled = mps.compile_circuit(qft(qubits), qubit_order=qubits)
+    states = amplitude_states(np.sqrt(frames), len(qubits))
+
+    final_states = np.empty(states.shape, dtype=np.complex128)
+    for i, state in enumerate(states):
+        trace.count('simulator_calls')
+        final_state = mps.run(compiled, initial_state=state, max_bond=max_bond)
+        final_states[i] = final_state.state_vector()
+        if truncation_errors is not None:
+            truncation_errors[i] = final_state.truncation_error
+    return final_states
+
+FRAME_BACKENDS = {
+    'numpy': simulate_frames,
+    'cirq': simulate_frames_cirq,
+    'mps': simulate_frames_mps,
+}
+
+def process_audio(input_file, output_file, backend='numpy', window_length=window_length, sr=2000, mono=True, max_bond=None):
+    """QFTs every amplitude-encoded window of the input and overlap-adds the inverse DCT of its probabilities.
+
+    backend='mps' simulates with matrix product states of at most max_bond singular values per bond,
+    trading fidelity for speed on long windows, and prints the truncation error it caused.
+    """
+    with trace.span('stft_quantum_2.process_audio', file=input_file):
+        # Load audio at sr
+        y, sr = load_audio(input_file, sr=sr, mono=mono)
+        hop = window_length // 2
+
+        # Cut every window of every channel, padding the last ones if necessary
+        starts = np.arange(0, y.shape[-1], hop)
+        padded = np.pad(y, [(0, 0)] * (y.ndim - 1) + [(0, window_length)])
+        frames = np.abs(np.lib.stride_tricks.sliding_window_view(padded, window_length, axis=-1)[..., starts, :])
+
+        # Simulate each frame of the window, all channels in one batch
+        n_frames = frames.size // window_length
+        simulate = FRAME_BACKENDS[backend]
+        truncation_errors = None
+        if backend == 'mps':
+            truncation_errors = np.zeros(n_frames)
+            simulate = functools.partial(simulate, max_bond=max_bond, truncation_errors=truncation_errors)
+
+        trace.count('frames', n_frames)
+        with trace.span('simulate', frames=n_frames):
+            final_states = simulate(frames.reshape(-1, window_length))
+            final_states = final_states.reshape(frames.shape[:-1] + final_states.shape[-1:])
 
-        simulator = cirq.Simulator()
-        result = simulator.simulate(circuit)
+        # Report how much fidelity the bond dimension cap cost
+        if truncation_errors is not None:
+            print('MPS truncation error:', {'max': float(truncation_errors.max()), 'mean': float(truncation_errors.mean())})
 
-        # Quantum state probabilities as the Fourier amplitudes
-        probabilities = np.abs(result.final_state_vector) ** 2
-        transformed_amplitudes = fftpack.idct(probabilities, n=window_length, norm='ortho')
+        with trace.span('inverse'):
+            # Quantum state probabilities as the Fourier amplitudes
+            probabilities = np.abs(final_states) ** 2
+            transformed_amplitudes = fftpack.idct(probabilities, n=window_length, norm='ortho', axis=-1)
 
-        # Overlap-add the inverse transformed window
-        y_reconstructed[i:i + window_length] += transformed_amplitudes
+            # Overlap-add the inverse transformed windows
+            y_reconstructed = np.zeros(padded.shape)
+            for i, start in enumerate(starts):
+                y_reconstructed[..., start:start + window_length] += transformed_amplitudes[..., i, :]
 
-    # Write to output file
-    sf.write(output_file, y_reconstructed, 2000)
+        # Write to output file, one column per channel
+        with trace.span('write'):
+            sf.write(output_file, y_reconstructed[..., :y.shape[-1]].T, sr)
 
-process_audio('kick2.wav', 'kick2_quantum.wav')
+if __name__ == "__main__":
+    process_audio('kick2.wav', 'kick2_quantum.wav')
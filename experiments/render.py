@@ -0,0 +1,137 @@
+import argparse
+import functools
+import hashlib
+import os
+import shutil
+import numpy as np
+from PIL import Image
+from experiments import trace
+from experiments.audio_io import CACHE_DIR, atomic_write, load_audio
+
+# Width of the preview images the experiments render next to their outputs, whatever the input length
+PREVIEW_WIDTH = 2048
+
+@functools.lru_cache(maxsize=None)
+def colormap_palette(name='inferno'):
+    """The 256 colors of a matplotlib colormap as a flat RGB palette for PIL.
+
+    matplotlib is only imported the first time a colormap is used; the palette is then kept in
+    CACHE_DIR, so later processes don't import it at all.
+    """
+    cache_file = os.path.join(CACHE_DIR, f'colormap_{name}.npy')
+    if os.path.exists(cache_file):
+        return np.load(cache_file).tobytes()
+
+    from matplotlib import colormaps
+    palette = np.round(colormaps[name](np.arange(256))[:, :3] * 255).astype(np.uint8)
+
+    with atomic_write(cache_file) as f:
+        np.save(f, palette)
+    return palette.tobytes()
+
+@functools.lru_cache(maxsize=None)
+def stft_plan(n_fft, block_frames=1024):
+    """Periodic Hann window and frame and spectrum buffers for an n_fft STFT, allocated once per size.
+
+    Every render with the same FFT size reuses them, so the STFT allocates nothing per block.
+    """
+    window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+    frames = np.empty((block_frames, n_fft), dtype=np.float32)
+    spectrum = np.empty((block_frames, n_fft // 2 + 1), dtype=np.complex64)
+    return window, frames, spectrum
+
+def spectrogram_db(y, n_fft=2048, hop_length=None, width=None, top_db=80.0):
+    """Power spectrogram of y in dB below its peak, clipped at -top_db, as a (bins, frames) float32 array.
+
+    Frames are hop_length apart (n_fft // 4 by default). Given a width instead, the hop is chosen so
+    the spectrogram has about width frames, whatever the length of y. y may be a memory map of any
+    numeric dtype: frames are converted to float32 a block at a time. A (channels, samples) y gives
+    (channels, bins, frames), in dB below the loudest channel's peak.
+    """
+    window, frames, spectrum = stft_plan(n_fft)
+    if y.shape[-1] < n_fft:
+        y = np.pad(y, [(0, 0)] * (y.ndim - 1) + [(0, n_fft - y.shape[-1])])
+    if hop_length is None:
+        hop_length = n_fft // 4 if width is None else max(1, -(-(y.shape[-1] - n_fft) // max(1, width - 1)))
+
+    windows = np.lib.stride_tricks.sliding_window_view(y, n_fft, axis=-1)[..., ::hop_length, :]
+    n_windows = windows.shape[-2]
+    power = np.empty(y.shape[:-1] + (n_fft // 2 + 1, n_windows), dtype=np.float32)
+
+    # Channels take turns with the plan's buffers, a block of frames at a time
+    for channel in np.ndindex(y.shape[:-1]):
+        for start in range(0, n_windows, len(frames)):
+            block = windows[channel][start:start + len(frames)]
+            n = len(block)
+
+            # Window the block into the reused frame buffer, then transform it into the spectrum buffer
+            np.multiply(block, window, out=frames[:n], casting='unsafe')
+            np.fft.rfft(frames[:n], axis=1, out=spectrum[:n])
+            np.square(np.abs(spectrum[:n]).T, out=power[channel][:, start:start + n])
+
+    # dB relative to the loudest bin; silence maps to the floor
+    peak = np.max(power)
+    np.maximum(power, max(peak, 1e-20) * 10 ** (-top_db / 10), out=power)
+    np.log10(power, out=power)
+    power -= np.log10(max(peak, 1e-20))
+    power *= 10
+    return power
+
+def spectrogram_image(y, n_fft=2048, hop_length=None, width=None, height=None, top_db=80.0, colormap='inferno'):
+    """Renders y's spectrogram as a palette image: low frequencies at the bottom, time left to right.
+
+    The dB values index the 256 colors of the colormap directly, without any matplotlib figure.
+    height resamples the frequency axis, which otherwise has a row per bin. The channels of a
+    (channels, samples) y are stacked from the top, first channel first.
+    """
+    db = spectrogram_db(y, n_fft, hop_length, width, top_db)
+
+    # Map [-top_db, 0] dB onto palette indices 0-255, with the highest frequencies in each channel's first row
+    db *= 255 / top_db
+    db += 255
+    indices = np.empty(db.shape, dtype=np.uint8)
+    np.copyto(indices, db[..., ::-1, :], casting='unsafe')
+
+    image = Image.fromarray(indices.reshape(-1, indices.shape[-1]), mode='P')
+    image.putpalette(colormap_palette(colormap))
+    if height is not None and height != image.height:
+        image = image.resize((image.width, height), Image.NEAREST)
+    return image
+
+def render_spectrogram(y, output_file, n_fft=2048, hop_length=None, width=None, height=None, top_db=80.0, colormap='inferno', cache=True):
+    """Writes y's spectrogram (see spectrogram_image) to output_file as a PNG.
+
+    With cache, images are kept in CACHE_DIR keyed on a hash of the samples and the rendering
+    parameters, so rendering the same audio the same way again is a file copy.
+    """
+    with trace.span('render', file=output_file):
+        if cache:
+            digest = hashlib.sha1(repr((n_fft, hop_length, width, height, top_db, colormap, y.dtype.str, y.shape[:-1])).encode())
+            digest.update(np.ascontiguousarray(y).data)
+            cache_file = os.path.join(CACHE_DIR, f'{digest.hexdigest()}_spectrogram.png')
+            if os.path.exists(cache_file):
+                shutil.copyfile(cache_file, output_file)
+                return
+
+        image = spectrogram_image(y, n_fft, hop_length, width, height, top_db, colormap)
+        image.save(output_file, format='png')
+
+        if cache:
+            with atomic_write(cache_file) as f, open(output_file, 'rb') as image_file:
+                shutil.copyfileobj(image_file, f)
+
+# Command-line arguments parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the spectrogram of an audio file as a PNG image.")
+    parser.add_argument('input', type=str, help='Path to input file')
+    parser.add_argument('output', type=str, help='Path to output image')
+    parser.add_argument('--n_fft', type=int, default=2048, help='FFT size, giving n_fft // 2 + 1 frequency rows')
+    parser.add_argument('--width', type=int, default=None, help='Number of time columns (default: one every n_fft // 4 samples)')
+    parser.add_argument('--height', type=int, default=None, help='Number of frequency rows to resample to')
+    parser.add_argument('--top_db', type=float, default=80.0, help='Dynamic range shown, in dB below the peak')
+    parser.add_argument('--colormap', type=str, default='inferno', help='Matplotlib colormap name')
+    parser.add_argument('--channels', action='store_true', help='Stack a spectrogram per channel instead of rendering the mono downmix')
+    args = parser.parse_args()
+
+    y, _ = load_audio(args.input, sr=None, mono=not args.channels, mmap=True)
+    render_spectrogram(y, args.output, args.n_fft, width=args.width, height=args.height, top_db=args.top_db, colormap=args.colormap)
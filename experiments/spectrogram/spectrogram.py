@@ -1,20 +1,83 @@
-import os
 import numpy as np
 import librosa
 import soundfile as sf
-import matplotlib.pyplot as plt
 from PIL import Image
+from experiments import trace
+from experiments.audio_io import load_audio
+from experiments.render import render_spectrogram
 
 def audio_to_spectrogram(y, sr, output_file):
-    D = librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max)
-    librosa.display.specshow(D, sr=sr, x_axis='time', y_axis='log')
-    plt.axis('off')
-    plt.savefig(output_file, bbox_inches='tight', pad_inches=0, format='png', dpi=300)
-    plt.close()
-
-def spectrogram_to_audio(input_file, output_file):
-    image = Image.open(input_file).convert('L')
-    data = np.array(image).astype(np.float32)
+    # One image row per frequency bin, highest first, and one column per 512-sample hop of a
+    # 2048-point STFT, the layout image_to_magnitude reads back
+    render_spectrogram(y, output_file, n_fft=2048, hop_length=512)
+
+def spectral_convergence(magnitude, rebuilt_magnitude):
+    """Relative Frobenius distance between the target magnitude and the one rebuilt from audio."""
+    return np.linalg.norm(magnitude - rebuilt_magnitude) / np.linalg.norm(magnitude)
+
+def griffin_lim(magnitude, n_iter=100, momentum=0.99, tol=1e-4, seed=None):
+    """Recovers audio from a magnitude spectrogram with the fast Griffin-Lim algorithm.
+
+    The momentum term (Perraudin et al., 2013) matches 500 rounds of plain Griffin-Lim in about 100;
+    momentum=0 gives the plain algorithm. Iteration stops after n_iter rounds or once the spectral
+    convergence changes by less than a fraction tol between rounds. All STFT buffers and the window
+    are allocated once and reused by every iteration.
+
+    magnitude may be (channels, bins, frames), giving (channels, samples): librosa transforms every
+    channel in the same call, and convergence is measured over all of them together.
+    """
+    import scipy.signal
+    magnitude = np.asarray(magnitude, dtype=np.float32)
+    n_fft = 2 * (magnitude.shape[-2] - 1)
+    hop_length = n_fft // 4
+    window = scipy.signal.get_window('hann', n_fft)
+
+    # Start from random phase
+    rng = np.random.default_rng(seed)
+    angles = np.exp(1j * rng.uniform(-np.pi, np.pi, size=magnitude.shape)).astype(np.complex64)
+
+    # Preallocated buffers: the time signal, the current and previous rebuilt STFT, and |rebuilt|
+    y = np.empty(magnitude.shape[:-2] + (hop_length * (magnitude.shape[-1] - 1),), dtype=np.float32)
+    rebuilt = np.zeros_like(angles)
+    previous = np.zeros_like(angles)
+    rebuilt_magnitude = np.empty_like(magnitude)
+
+    convergence = np.inf
+    for _ in range(n_iter):
+        trace.count('griffin_lim_iterations')
+        rebuilt, previous = previous, rebuilt
+
+        # Project onto consistent spectrograms
+        np.multiply(angles, magnitude, out=angles)
+        librosa.istft(angles, hop_length=hop_length, n_fft=n_fft, window=window, out=y)
+        librosa.stft(y, n_fft=n_fft, hop_length=hop_length, window=window, out=rebuilt)
+
+        # Stop once the rebuilt magnitude has settled
+        np.abs(rebuilt, out=rebuilt_magnitude)
+        previous_convergence, convergence = convergence, spectral_convergence(magnitude, rebuilt_magnitude)
+        if abs(previous_convergence - convergence) < tol * convergence:
+            break
+
+        # Accelerated phase update, projected back onto unit magnitude
+        np.multiply(previous, -momentum / (1 + momentum), out=angles)
+        angles += rebuilt
+        angles /= np.abs(angles) + 1e-16
+
+    return librosa.istft(rebuilt, hop_length=hop_length, n_fft=n_fft, window=window)
+
+def image_to_magnitude(image):
+    """The grayscale spectrogram image as a float32 array, split into (channels, bins, frames) if it stacks several.
+
+    The images audio_to_spectrogram renders have a row per bin of a 2048-point STFT, 1025 per channel,
+    with the highest frequency at the top; the rows are flipped back so that row i is bin i.
+    """
+    data = np.array(image.convert('L')).astype(np.float32)
+    if len(data) > 1025 and len(data) % 1025 == 0:
+        data = data.reshape(-1, 1025, data.shape[-1])
+    return data[..., ::-1, :]
+
+def spectrogram_to_audio(input_file, output_file, n_iter=100):
+    data = image_to_magnitude(Image.open(input_file))
 
     # Convert the 8-bit data to floating-point data
     data = (data / 255.0) ** 2
@@ -23,43 +86,26 @@ def spectrogram_to_audio(input_file, output_file):
     data_inverted = np.exp(data)
 
     # Perform the Griffin-Lim algorithm to recover audio
-    p = np.random.uniform(-np.pi, np.pi, size=data_inverted.shape)
-
-    for i in range(500):
-        S_complex = data_inverted * np.exp(1j * p)
-        y = librosa.istft(S_complex)
-
-        p = np.angle(librosa.stft(y))
-
-    sf.write(output_file, y, 44100)
+    y = griffin_lim(data_inverted, n_iter=n_iter)
 
-def process_audio(input_file):
-    # Load audio file and convert to mono
-    y, sr = librosa.load(input_file, sr=None, mono=True)
+    sf.write(output_file, y.T, 44100)
 
-    # Resample to 44.1kHz if necessary
-    if sr != 44100:
-        y = librosa.resample(y, orig_sr=sr, target_sr=44100)
-        sr = 44100
+def process_audio(input_file, n_iter=100, output_file="output.wav", spectrogram_file="spectrogram.png", mono=True):
+    with trace.span('spectrogram.process_audio', file=input_file):
+        # Load audio at 44.1kHz
+        y, sr = load_audio(input_file, sr=44100, mono=mono)
 
-    spectrogram_file = "spectrogram.png"
-
-    # Generate spectrogram image if it doesn't exist
-    if not os.path.isfile(spectrogram_file):
+        # Generate the spectrogram image of this input; render's cache makes an unchanged input a file copy
         audio_to_spectrogram(y, sr, spectrogram_file)
 
-    # Convert spectrogram back to audio
-    spectrogram_image = Image.open(spectrogram_file).convert('L')
-    data_inverted = np.array(spectrogram_image).astype(np.float32)
-    p = np.random.uniform(-np.pi, np.pi, size=data_inverted.shape)
-
-    for i in range(500):
-        S_complex = data_inverted * np.exp(1j * p)
-        y = librosa.istft(S_complex)
-
-        p = np.angle(librosa.stft(y))
+        # Convert spectrogram back to audio, a channel per stacked spectrogram
+        data_inverted = image_to_magnitude(Image.open(spectrogram_file))
+        with trace.span('inverse', n_iter=n_iter):
+            y = griffin_lim(data_inverted, n_iter=n_iter)
 
-    sf.write("output.wav", y, 44100)
+        with trace.span('write'):
+            sf.write(output_file, y.T, 44100)
 
 # Test the function
-process_audio('../../wavs/input.wav')
+if __name__ == "__main__":
+    process_audio('../../wavs/input.wav')
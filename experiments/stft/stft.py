@@ -1,45 +1,341 @@
 import numpy as np
-import scipy.io.wavfile
-import scipy.signal
-import librosa
 import soundfile as sf
+from experiments import derivative, trace
+from experiments.audio_io import load_audio, read_blocks
 
-def process_audio(input_file, output_file):
-    # Load audio file and convert to mono
-    y, sr = librosa.load(input_file, sr=None, mono=True)
+def derivative_effect(y, sr):
+    """Rebuilds the STFT of y from the derivatives of its amplitude and phase, returning the audio.
 
-    # Resample to 44.1kHz if necessary
-    if sr != 44100:
-        y = librosa.resample(y, sr, 44100)
-        sr = 44100
+    y is (samples,) or (channels, samples); every channel is transformed in the same batched calls.
+    """
+    # scipy.signal takes over a second to import, so only load it once it is needed
+    import scipy.signal
 
     # Define STFT parameters
     window_length = int(sr * .01)  # 10ms window
     window_hop = window_length // 2  # 50% overlap
 
-    # Compute STFT
-    f, t, stft = scipy.signal.stft(y, sr, nperseg=window_length, noverlap=window_hop)
+    # Compute STFT, (..., frequencies, frames) with a leading axis for channels
+    with trace.span('transform'):
+        f, t, stft = scipy.signal.stft(y, sr, nperseg=window_length, noverlap=window_hop)
+    trace.count('frames', stft.shape[-1])
 
-    # Compute amplitude and phase
-    amplitude = np.abs(stft)
-    phase = np.angle(stft)
+    # Rebuild the STFT from the derivatives of its amplitude and phase, in preallocated buffers,
+    # with the frequencies of every channel as the rows of one spectrum
+    with trace.span('derivative'):
+        stft_reconstructed, _ = derivative.round_trip(stft.reshape(-1, stft.shape[-1]), t[1] - t[0])
+        stft_reconstructed = stft_reconstructed.reshape(stft.shape)
 
-    # Compute their derivatives
-    amplitude_derivative = np.diff(amplitude, axis=-1) / (t[1] - t[0])
-    phase_derivative = np.diff(np.unwrap(phase), axis=-1) / (t[1] - t[0])
+    # Compute the inverse STFT
+    with trace.span('inverse'):
+        t, y_reconstructed = scipy.signal.istft(stft_reconstructed, sr, nperseg=window_length, noverlap=window_hop)
 
-    # Reconstruct amplitude and phase from their derivatives
-    amplitude_reconstructed = np.cumsum(np.pad(amplitude_derivative, ((0, 0), (1, 0))), axis=-1)
-    phase_reconstructed = np.cumsum(np.pad(phase_derivative, ((0, 0), (1, 0))), axis=-1)
+    return y_reconstructed
 
-    # Construct the STFT from the reconstructed amplitude and phase
-    stft_reconstructed = amplitude_reconstructed * np.exp(1j * phase_reconstructed)
+def process_audio(input_file, output_file, mono=True):
+    with trace.span('stft.process_audio', file=input_file):
+        # Load audio at 44.1kHz
+        y, sr = load_audio(input_file, sr=44100, mono=mono)
 
-    # Compute the inverse STFT
-    t, y_reconstructed = scipy.signal.istft(stft_reconstructed, sr, nperseg=window_length, noverlap=window_hop)
+        y_reconstructed = derivative_effect(y, sr)
+
+        # Write to output file, one column per channel
+        with trace.span('write'):
+            sf.write(output_file, y_reconstructed.T, sr)
+
+def frame_spacing(window_length, window_hop, sr):
+    """Time between STFT frames, computed the way scipy.signal.stft lays out its time axis."""
+    # A float64 scalar, like t[1] - t[0], so float32 derivatives are promoted the same way
+    return np.float64((window_length / 2 + window_length - window_hop) / sr - (window_length / 2) / sr)
+
+def stft_stream(blocks, window_length, window_hop):
+    """Yields the frames of scipy.signal.stft(y, nperseg=window_length, noverlap=window_hop), block by block.
+
+    Blocks are (samples,) or (channels, samples), giving frames shaped (..., frequencies, frames).
+    """
+    import scipy.fft
+    import scipy.signal
+    step = window_length - window_hop
+
+    # Mirror scipy's dtypes exactly (complex64 window, float64 segments) so frames match bit for bit
+    window = scipy.signal.get_window('hann', window_length).astype(np.complex64)
+    scale = np.sqrt(1.0 / window.sum() ** 2)
+
+    # Samples not yet covered by a full frame, starting with the zero boundary extension once the channels are known
+    pending = None
+
+    def frames(samples):
+        segments = np.lib.stride_tricks.sliding_window_view(samples, window_length, axis=-1)[..., ::step, :]
+        stft = scipy.fft.rfft((window * segments).real, n=window_length)
+        stft *= scale
+        return np.swapaxes(stft.astype(np.complex64), -1, -2)
+
+    for block in blocks:
+        if pending is None:
+            pending = np.zeros(block.shape[:-1] + (window_length // 2,))
+        pending = np.concatenate([pending, block], axis=-1)
+        n_frames = (pending.shape[-1] - window_length) // step + 1
+        if n_frames > 0:
+            yield frames(pending[..., :(n_frames - 1) * step + window_length])
+            pending = pending[..., n_frames * step:]
+
+    if pending is None:
+        return
+
+    # Closing boundary extension, padded to a whole number of frames
+    pending = np.concatenate([pending, np.zeros(pending.shape[:-1] + (window_length // 2,))], axis=-1)
+    pending = np.pad(pending, [(0, 0)] * (pending.ndim - 1) + [(0, -(pending.shape[-1] - window_length) % step)])
+    if pending.shape[-1] >= window_length:
+        yield frames(pending)
+
+def derivative_stream(stft_blocks, dt):
+    """Applies the amplitude/phase derivative round trip to a stream of STFT blocks."""
+    # The running state carries the last frame and the running sums from block to block, so the
+    # result is the same as the batch round trip (see derivative.py)
+    state = None
+    for stft in stft_blocks:
+        trace.count('frames', stft.shape[-1])
+        stft_reconstructed, state = derivative.round_trip(stft.reshape(-1, stft.shape[-1]), dt, state)
+        yield stft_reconstructed.reshape(stft.shape)
+
+def istft_stream(stft_blocks, window_length, window_hop):
+    """Yields the samples of scipy.signal.istft for a stream of STFT blocks as soon as they are final."""
+    import scipy.fft
+    import scipy.signal
+    step = window_length - window_hop
+    boundary = window_length // 2
+    window = scipy.signal.get_window('hann', window_length)
+
+    # Overlap-add state for the samples the next frame still contributes to, once the channels are known;
+    # the window norm is the same for every channel
+    tail = None
+    norm_tail = np.zeros(window_length - step)
+
+    # Samples held back until we know whether they belong to the closing boundary extension
+    held = None
+    to_skip = boundary
+
+    def emit(samples):
+        nonlocal held, to_skip
+        samples = np.concatenate([held, samples], axis=-1)
+        skipped = min(to_skip, samples.shape[-1])
+        to_skip -= skipped
+        samples = samples[..., skipped:]
+        held = samples[..., max(samples.shape[-1] - boundary, 0):]
+        return samples[..., :samples.shape[-1] - held.shape[-1]]
+
+    for stft in stft_blocks:
+        if tail is None:
+            tail = np.zeros(stft.shape[:-2] + (window_length - step,))
+            held = np.zeros(stft.shape[:-2] + (0,))
+        n_frames = stft.shape[-1]
+        segments = scipy.fft.irfft(stft, n=window_length, axis=-2)[..., :window_length, :] * window.sum()
+
+        # Window and overlap-add every frame in order, carrying in the tail of the previous block
+        length = (n_frames - 1) * step + window_length
+        indices = (np.arange(n_frames)[:, np.newaxis] * step + np.arange(window_length)).ravel()
+        x = np.zeros(stft.shape[:-2] + (length,))
+        norm = np.zeros(length)
+        x[..., :tail.shape[-1]] = tail
+        norm[:len(norm_tail)] = norm_tail
+        windowed = np.swapaxes(segments, -1, -2) * window
+        np.add.at(x, (Ellipsis, indices), windowed.reshape(windowed.shape[:-2] + (-1,)))
+        np.add.at(norm, indices, np.tile(window ** 2, n_frames))
+
+        done = n_frames * step
+        tail, norm_tail = x[..., done:], norm[done:]
+        yield emit(x[..., :done] / np.where(norm[:done] > 1e-10, norm[:done], 1.0))
+
+    if tail is None:
+        return
+
+    # Flush the last overlap and drop the closing boundary extension
+    yield emit(tail / np.where(norm_tail > 1e-10, norm_tail, 1.0))
+
+def derivative_effect_stream(input_file, blocksize=65536, sr=44100, mono=True):
+    """Yields the output of derivative_effect block by block, holding only a few blocks in memory.
+
+    With mono=False blocks are (channels, samples).
+    """
+    # Define STFT parameters
+    window_length = int(sr * .01)  # 10ms window
+    window_hop = window_length // 2  # 50% overlap
+
+    blocks = read_blocks(input_file, blocksize, sr, mono)
+    if not mono:
+        blocks = (block.T for block in blocks)
+    stft_blocks = stft_stream(blocks, window_length, window_hop)
+    stft_blocks = derivative_stream(stft_blocks, frame_spacing(window_length, window_hop, sr))
+    return istft_stream(stft_blocks, window_length, window_hop)
+
+def process_audio_streaming(input_file, output_file, blocksize=65536, mono=True):
+    """Same result as process_audio, with constant memory regardless of the input length."""
+    sr = 44100
+    channels = 1 if mono else sf.info(input_file).channels
+
+    # Write to output file as each block completes
+    with trace.span('stft.process_audio_streaming', file=input_file), \
+            sf.SoundFile(output_file, 'w', samplerate=sr, channels=channels) as outfile:
+        for block in derivative_effect_stream(input_file, blocksize, sr, mono):
+            outfile.write(block.T)
+
+def check_streaming_parity(input_file, blocksize=65536, rtol=0.0, mono=True):
+    """Compares the streaming result against the batch result (bit for bit by default), returning the max relative error."""
+    y, sr = load_audio(input_file, sr=44100, mono=mono)
+    expected = derivative_effect(y, sr)
+    actual = np.concatenate(list(derivative_effect_stream(input_file, blocksize, sr, mono)), axis=-1)
+
+    if actual.shape != expected.shape:
+        raise AssertionError(f'Streaming produced {actual.shape} samples, batch produced {expected.shape}')
+    error = np.max(np.abs(actual - expected)) / np.max(np.abs(expected))
+    if error > rtol:
+        raise AssertionError(f'Streaming result differs from batch by {error:.3g} (rtol {rtol:.3g})')
+    return error
+
+class RealtimeDerivativeEffect:
+    """derivative_effect frame by frame, for an audio callback or a generator of sample blocks.
+
+    Samples go into a buffer holding the last window. Each time a frame's worth has arrived, the
+    frame is transformed, run through the derivative round trip (carrying its state from frame to
+    frame) and overlap-added into the output. Every buffer is allocated up front, so process()
+    allocates nothing but a few scalars per block. Outputs are those of derivative_effect delayed by
+    latency (window_length - 1) samples, which is as soon as every one of them is final.
+
+    reconstruct turns the derivatives back into a spectrum like derivative.reconstruct, which it
+    defaults to; stft_quantum.quantum_reconstruct gives the quantum-scaled variant.
+    """
+
+    def __init__(self, sr=44100, blocksize=1024, reconstruct=derivative.reconstruct, backend=None):
+        import scipy.signal
+
+        # Define STFT parameters, as derivative_effect does
+        self.window_length = int(sr * .01)  # 10ms window
+        self.step = self.window_length - self.window_length // 2  # 50% overlap
+        self.blocksize = blocksize
+        self.latency = self.window_length - 1
+        self.dt = frame_spacing(self.window_length, self.window_length // 2, sr)
+        self.reconstruct = reconstruct
+        self.backend = backend
+
+        # Mirror scipy's windows and dtypes, like stft_stream and istft_stream, so frames match bit for bit
+        window = scipy.signal.get_window('hann', self.window_length)
+        self.analysis_window = window.astype(np.complex64).real.astype(np.float64)
+        self.scale = np.sqrt(1.0 / window.astype(np.complex64).sum() ** 2)
+        self.synthesis_window = window
+        self.window_sum = window.sum()
+
+        # Once running, every output sample is covered by the same frames, so its overlap-add norm is fixed
+        norm = np.zeros(self.step)
+        norm[:self.window_length - self.step] += window[self.step:] ** 2
+        norm += window[:self.step] ** 2
+        self.norm = np.where(norm > 1e-10, norm, 1.0)
+
+        # Buffers for one frame: its samples, spectrum, derivatives, rebuilt spectrum and segment
+        bins = self.window_length // 2 + 1
+        self.frame = np.empty(self.window_length)
+        self.windowed = np.empty(self.window_length)
+        self.spectrum = np.empty(bins, dtype=np.complex128)
+        self.spectrum_column = np.empty((bins, 1), dtype=np.complex64)
+        self.derivatives = np.empty((bins, 1)), np.empty((bins, 1))
+        self.reconstructed = np.empty((bins, 1), dtype=np.complex128)
+        self.segment = np.empty(self.window_length)
+        self.overlap = np.empty(self.window_length)
+        self.final = np.empty(self.step)
+
+        # Output ring buffer and the block handed back when the caller gives no output buffer
+        self.output = np.empty(self.window_length + blocksize)
+        self.block = np.empty(blocksize)
+        self.reset()
+
+    def reset(self):
+        """Starts a new stream, as if nothing had been processed yet."""
+        # The frame buffer starts with the zero boundary extension scipy pads the signal with
+        self.frame[:] = 0
+        self.filled = self.window_length // 2
+        self.overlap[:] = 0
+        self.state = None
+        self.to_skip = self.window_length // 2
+
+        # The first latency samples out are silence
+        self.output[:] = 0
+        self.written = self.latency
+        self.read = 0
+
+    def write_output(self, samples):
+        start = self.written % len(self.output)
+        first = min(len(samples), len(self.output) - start)
+        self.output[start:start + first] = samples[:first]
+        self.output[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def read_output(self, out):
+        start = self.read % len(self.output)
+        first = min(len(out), len(self.output) - start)
+        out[:first] = self.output[start:start + first]
+        out[first:] = self.output[:len(out) - first]
+        self.read += len(out)
+
+    def process_frame(self):
+        trace.count('frames')
+
+        # Window and transform the frame, in scipy.signal.stft's precision
+        np.multiply(self.analysis_window, self.frame, out=self.windowed)
+        np.fft.rfft(self.windowed, out=self.spectrum)
+        self.spectrum *= self.scale
+        self.spectrum_column[:, 0] = self.spectrum
+
+        # Derivative round trip, continuing from the previous frame
+        amplitude_derivative, phase_derivative, self.state = derivative.decompose(
+            self.spectrum_column, self.dt, self.state, self.derivatives, self.backend)
+        stft_reconstructed, self.state = self.reconstruct(amplitude_derivative, phase_derivative, self.state, self.reconstructed)
+
+        # Inverse transform and overlap-add; the first step samples are then final
+        np.fft.irfft(stft_reconstructed[:, 0], n=self.window_length, out=self.segment)
+        self.segment *= self.window_sum
+        self.segment *= self.synthesis_window
+        self.overlap += self.segment
+        np.divide(self.overlap[:self.step], self.norm, out=self.final)
+
+        # Drop the opening boundary extension, then queue the rest for output
+        skipped = min(self.to_skip, self.step)
+        self.to_skip -= skipped
+        self.write_output(self.final[skipped:])
+
+        # Slide the frame and the overlap along by one step
+        self.frame[:self.window_length - self.step] = self.frame[self.step:]
+        self.filled = self.window_length - self.step
+        self.overlap[:self.window_length - self.step] = self.overlap[self.step:]
+        self.overlap[self.window_length - self.step:] = 0
+
+    def process(self, block, out=None):
+        """Processes up to blocksize samples, returning as many output samples latency samples behind.
+
+        The output goes into out if given (a slice of a callback's output buffer, say), otherwise into
+        a buffer of the effect's own that the next call overwrites.
+        """
+        if len(block) > self.blocksize:
+            raise ValueError(f'Block of {len(block)} samples is larger than blocksize {self.blocksize}')
+        if out is None:
+            out = self.block[:len(block)]
+
+        # Fill the frame buffer, processing a frame every time it is full
+        position = 0
+        while position < len(block):
+            taken = min(len(block) - position, self.window_length - self.filled)
+            self.frame[self.filled:self.filled + taken] = block[position:position + taken]
+            self.filled += taken
+            position += taken
+            if self.filled == self.window_length:
+                self.process_frame()
+
+        self.read_output(out)
+        return out
 
-    # Write to output file
-    sf.write(output_file, y_reconstructed, sr)
+    def stream(self, blocks):
+        """Yields the output of every block of samples; each is overwritten by the next, so copy any you keep."""
+        for block in blocks:
+            yield self.process(block)
 
 # Test the function
-process_audio('input.wav', 'output.wav')
+if __name__ == "__main__":
+    process_audio('input.wav', 'output.wav')
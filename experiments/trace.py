@@ -0,0 +1,198 @@
+import argparse
+import atexit
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Lightweight tracing for the experiments: spans time the stages of a run, counters count frames,
+# chunks and simulator calls, and snapshots record memory. Events are Chrome trace events. Given a
+# path, they are appended to it as JSON lines as they happen, so worker processes add theirs to the
+# same file and long runs hold nothing in memory; without one, they are kept in events. Tracing is off by default, and then span() hands back a shared no-op
+# context and count() returns at once.
+#
+# Setting QUANTUM_MUSIC_TRACE to a path turns tracing on for every process that imports this
+# module, without touching any code; QUANTUM_MUSIC_TRACE_MEMORY=1 adds tracemalloc peaks to spans.
+# python -m experiments.trace summarizes such a file and converts it to Chrome's format.
+
+enabled = False
+memory = False
+events = []
+counters = collections.Counter()
+
+# Counters changed since they were last emitted, the file events are appended to and the process that opened it
+_changed = set()
+_path = None
+_sink = None
+_sink_pid = None
+
+# Peak traced memory of each open span, innermost last, and whether enable() started tracemalloc
+_peaks = []
+_started_tracemalloc = False
+
+NULL_SPAN = contextlib.nullcontext()
+
+def enable(path=None, memory_peaks=False):
+    """Starts recording events, appending them to path as JSON lines if given and keeping them in events otherwise.
+
+    memory_peaks starts tracemalloc.
+    """
+    global enabled, memory, _path, _started_tracemalloc
+    enabled = True
+    _path = path
+    memory = memory_peaks
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+
+def disable():
+    """Stops recording, emitting any counters not emitted yet."""
+    global enabled, memory, _started_tracemalloc
+    emit_counters()
+    enabled = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+    memory = False
+
+def reset():
+    """Forgets the events and counters recorded so far."""
+    events.clear()
+    counters.clear()
+    _changed.clear()
+
+def _now():
+    return time.perf_counter_ns() // 1000
+
+def _record(event):
+    global _sink, _sink_pid
+    event['pid'] = os.getpid()
+    event['tid'] = threading.get_ident()
+    if _path is None:
+        events.append(event)
+        return
+
+    # Each process opens the file itself, so forked workers don't share a file object
+    if _sink_pid != event['pid']:
+        _sink = open(_path, 'a', buffering=1)
+        _sink_pid = event['pid']
+    _sink.write(json.dumps(event) + '\n')
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if memory:
+            # Fold the peak so far into the enclosing span, then measure this one from here
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            _peaks.append(0)
+        self.start = _now()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = _now()
+        if memory and _peaks:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(_peaks.pop(), peak)
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.args['memory'] = current
+            self.args['peak_memory'] = peak
+        _record({'name': self.name, 'ph': 'X', 'ts': self.start, 'dur': end - self.start, 'args': self.args})
+        emit_counters()
+        return False
+
+def span(name, **args):
+    """Context manager timing a stage named name, with args added to its event."""
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+def count(name, n=1):
+    """Adds n to the counter name."""
+    if enabled:
+        counters[name] += n
+        _changed.add(name)
+
+def emit_counters():
+    """Records the counters that changed since they were last recorded, as one counter event."""
+    if enabled and _changed:
+        _record({'name': 'counters', 'ph': 'C', 'ts': _now(), 'args': {name: counters[name] for name in _changed}})
+        _changed.clear()
+
+def snapshot(name):
+    """Records the memory tracemalloc traces now, and its peak, as an instant event."""
+    if enabled and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        _record({'name': name, 'ph': 'i', 's': 'p', 'ts': _now(), 'args': {'memory': current, 'peak_memory': peak}})
+
+def read_jsonl(path):
+    """The events of a JSON lines trace, skipping a line cut short by a killed process."""
+    read = []
+    with open(path) as f:
+        for line in f:
+            with contextlib.suppress(json.JSONDecodeError):
+                read.append(json.loads(line))
+    return read
+
+def export_jsonl(path, trace_events=None):
+    """Writes events (by default those kept in memory by this process, when tracing without a path) as JSON lines."""
+    with open(path, 'w') as f:
+        for event in events if trace_events is None else trace_events:
+            f.write(json.dumps(event) + '\n')
+
+def export_chrome(path, trace_events=None):
+    """Writes events (by default those kept in memory by this process, when tracing without a path) in Chrome's trace format, for chrome://tracing or Perfetto."""
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events if trace_events is None else trace_events, 'displayTimeUnit': 'ms'}, f)
+
+def summarize(trace_events):
+    """Total time, calls and largest memory peak per span name, and the final value of every counter."""
+    spans = {}
+    final_counters = collections.defaultdict(dict)
+    for event in trace_events:
+        if event['ph'] == 'X':
+            stats = spans.setdefault(event['name'], {'calls': 0, 'seconds': 0.0, 'peak_memory': None})
+            stats['calls'] += 1
+            stats['seconds'] += event['dur'] / 1e6
+            if 'peak_memory' in event['args']:
+                stats['peak_memory'] = max(stats['peak_memory'] or 0, event['args']['peak_memory'])
+        elif event['ph'] == 'C':
+            final_counters[event['pid']].update(event['args'])
+
+    # Counters are per process, so add up the last value each process reported
+    totals = collections.Counter()
+    for process_counters in final_counters.values():
+        totals.update(process_counters)
+    return spans, dict(totals)
+
+# Turn tracing on for the whole run when asked to through the environment
+if os.environ.get('QUANTUM_MUSIC_TRACE'):
+    enable(os.environ['QUANTUM_MUSIC_TRACE'], os.environ.get('QUANTUM_MUSIC_TRACE_MEMORY') == '1')
+    atexit.register(emit_counters)
+
+# Command-line arguments parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a JSON lines trace and optionally convert it to Chrome's trace format.")
+    parser.add_argument('input', type=str, help='Path to a JSON lines trace')
+    parser.add_argument('--chrome', type=str, default=None, help='Path to write a Chrome trace to')
+    args = parser.parse_args()
+
+    trace_events = read_jsonl(args.input)
+    spans, totals = summarize(trace_events)
+    for name, stats in sorted(spans.items(), key=lambda item: -item[1]['seconds']):
+        peak = '' if stats['peak_memory'] is None else f', peak {stats["peak_memory"] / 2 ** 20:.1f} MB'
+        print(f'{name:<32} {stats["seconds"]:9.3f}s over {stats["calls"]} calls{peak}')
+    for name, value in sorted(totals.items()):
+        print(f'{name:<32} {value}')
+
+    if args.chrome is not None:
+        export_chrome(args.chrome, trace_events)
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+import soundfile as sf
+from experiments.fft import fft
+
+SR = 44100
+
+@pytest.fixture(params=[4410, 4411], ids=['even', 'odd'])
+def fixture_file(request, tmp_path):
+    """A short 44.1kHz WAV of two tones over noise, with an offset so the DC bin isn't empty."""
+    rng = np.random.default_rng(request.param)
+    t = np.arange(request.param) / SR
+    y = 0.4 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 1234.5 * t) + 0.05 * rng.standard_normal(len(t)) + 0.1
+    path = tmp_path / 'fixture.wav'
+    sf.write(path, y.astype(np.float32), SR, subtype='FLOAT')
+    return str(path)
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('mix', [100, 50])
+def test_matches_reference(fixture_file, dtype, mix):
+    error, _ = fft.check_against_reference(fixture_file, mix=mix, dtype=dtype)
+    assert error <= (1e-9 if dtype == np.float64 else 1e-2)
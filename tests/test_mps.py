@@ -0,0 +1,56 @@
+import os
+import cirq
+import numpy as np
+import pytest
+import soundfile as sf
+from experiments.quantum import mps, script
+from test_statevector import random_circuit
+
+@pytest.mark.parametrize('seed', range(20))
+def test_exact_mps_matches_cirq(seed):
+    circuit, resolver = random_circuit(n_qubits=2 + seed % 7, n_gates=40, seed=seed)
+    difference, truncation_error, _ = mps.check_against_cirq(circuit, resolver, atol=1e-6)
+    assert truncation_error == 0
+
+@pytest.mark.parametrize('max_bond', [1, 2, 4])
+@pytest.mark.parametrize('seed', range(10))
+def test_truncated_mps_reports_its_infidelity(max_bond, seed):
+    circuit, resolver = random_circuit(n_qubits=8, n_gates=80, seed=seed)
+
+    # check_against_cirq asserts the infidelity to Cirq's state is within twice the reported truncation error
+    _, truncation_error, bond_dimension = mps.check_against_cirq(circuit, resolver, max_bond=max_bond)
+    assert bond_dimension <= max_bond
+    assert 0 <= truncation_error <= 1
+
+def test_truncation_error_is_reported_when_bonds_are_capped():
+    circuit, resolver = random_circuit(n_qubits=8, n_gates=200, seed=0)
+    assert mps.simulate(circuit, resolver, max_bond=2).truncation_error > 1e-3
+
+@pytest.mark.parametrize('max_bond', [None, 2])
+@pytest.mark.parametrize('seed', range(10))
+def test_expectation_z_matches_cirq(max_bond, seed):
+    circuit, resolver = random_circuit(n_qubits=6, n_gates=50, seed=seed)
+    state = mps.simulate(circuit, resolver, max_bond=max_bond)
+
+    # Compared against the MPS's own state vector, so truncation doesn't matter
+    state_vector = state.state_vector()
+    qubits = sorted(circuit.all_qubits())
+    qubit_map = {qubit: i for i, qubit in enumerate(qubits)}
+    expected = [cirq.Z(qubit).expectation_from_state_vector(state_vector, qubit_map).real for qubit in qubits]
+    np.testing.assert_allclose(state.expectation_z(), expected, rtol=0, atol=1e-9)
+
+def test_sweep_matches_single_runs():
+    circuit, _ = random_circuit(n_qubits=6, n_gates=60, seed=3)
+    symbols = sorted(cirq.parameter_names(circuit))
+    rng = np.random.default_rng(0)
+    resolvers = [cirq.ParamResolver({name: float(rng.uniform(-2, 2)) for name in symbols}) for _ in range(4)]
+    for state, resolver in zip(mps.simulate_sweep(circuit, resolvers), resolvers):
+        np.testing.assert_allclose(state.state_vector(), mps.simulate(circuit, resolver).state_vector(), rtol=0, atol=1e-12)
+
+def test_expectation_readout_without_mps_creates_no_files(tmp_path):
+    input_file = str(tmp_path / 'input.wav')
+    sf.write(input_file, np.zeros(256, dtype=np.float32), 44100)
+    with pytest.raises(ValueError):
+        script.process_audio(input_file, str(tmp_path / 'output.wav'), backend='numpy', readout='expectation',
+                             archive_file=str(tmp_path / 'data' / 'circuits.qca'), spectrogram_files=None)
+    assert sorted(os.listdir(tmp_path)) == ['input.wav']
@@ -0,0 +1,48 @@
+import numpy as np
+import librosa
+import pytest
+import soundfile as sf
+from PIL import Image
+from experiments import render
+from experiments.spectrogram import spectrogram
+
+SR = 44100
+
+def tone(frequency, seconds=0.5):
+    t = np.arange(int(seconds * SR)) / SR
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+def dominant_bins(magnitude):
+    """The strongest frequency bin of each channel, over the whole signal."""
+    return np.argmax(magnitude.sum(axis=-1), axis=-1)
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(render, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+@pytest.mark.parametrize('frequency', [60.0, 1000.0, 8000.0])
+def test_dominant_bin_survives_image_round_trip(tmp_path, frequency):
+    y = tone(frequency)
+    spectrogram.audio_to_spectrogram(y, SR, str(tmp_path / 'spectrogram.png'))
+    magnitude = spectrogram.image_to_magnitude(Image.open(tmp_path / 'spectrogram.png'))
+
+    assert magnitude.shape[0] == 1025
+    assert dominant_bins(magnitude) == dominant_bins(np.abs(librosa.stft(y, n_fft=2048, hop_length=512)))
+
+def test_stacked_channels_keep_their_order(tmp_path):
+    y = np.stack([tone(200.0), tone(5000.0)])
+    spectrogram.audio_to_spectrogram(y, SR, str(tmp_path / 'spectrogram.png'))
+    magnitude = spectrogram.image_to_magnitude(Image.open(tmp_path / 'spectrogram.png'))
+
+    assert magnitude.shape[:2] == (2, 1025)
+    np.testing.assert_array_equal(dominant_bins(magnitude), dominant_bins(np.abs(librosa.stft(y, n_fft=2048, hop_length=512))))
+
+def test_process_audio_follows_a_changed_input(tmp_path):
+    input_file = str(tmp_path / 'input.wav')
+    output_file = str(tmp_path / 'output.wav')
+    # Tones at bin centers, so Griffin-Lim's random starting phase can't tip them into a neighbouring bin
+    for frequency_bin in (14, 140):
+        sf.write(input_file, tone(frequency_bin * SR / 2048), SR)
+        spectrogram.process_audio(input_file, output_file=output_file, spectrogram_file=str(tmp_path / 'input.png'))
+        y, _ = sf.read(output_file, dtype='float32')
+        assert dominant_bins(np.abs(librosa.stft(y, n_fft=2048, hop_length=512))) == frequency_bin
@@ -0,0 +1,60 @@
+import cirq
+import numpy as np
+import pytest
+import sympy
+from experiments.quantum import statevector
+
+def random_circuit(n_qubits, n_gates, seed):
+    """A circuit of random H, CZPow, SWAP, rx, rz and X gates, with some exponents left as symbols."""
+    rng = np.random.default_rng(seed)
+    qubits = cirq.LineQubit.range(n_qubits)
+    resolver = {}
+
+    def exponent():
+        if rng.random() < 0.3:
+            symbol = sympy.Symbol(f'theta_{len(resolver)}')
+            resolver[symbol.name] = float(rng.uniform(-2, 2))
+            return symbol
+        return float(rng.uniform(-2, 2))
+
+    ops = []
+    for _ in range(n_gates):
+        kind = rng.choice(['h', 'czpow', 'swap', 'rx', 'rz', 'x'])
+        a, b = (qubits[i] for i in rng.choice(n_qubits, 2, replace=False))
+        if kind == 'h':
+            ops.append(cirq.H(a))
+        elif kind == 'czpow':
+            ops.append(cirq.CZPowGate(exponent=exponent())(a, b))
+        elif kind == 'swap':
+            ops.append(cirq.SWAP(a, b))
+        elif kind == 'rx':
+            ops.append(cirq.rx(np.pi * exponent())(a))
+        elif kind == 'rz':
+            ops.append(cirq.rz(np.pi * exponent())(a))
+        else:
+            ops.append(cirq.X(a))
+    return cirq.Circuit(ops), cirq.ParamResolver(resolver)
+
+@pytest.mark.parametrize('dtype, atol', [(np.complex64, 1e-5), (np.complex128, 1e-12)])
+@pytest.mark.parametrize('seed', range(20))
+def test_random_circuits_match_cirq(dtype, atol, seed):
+    circuit, resolver = random_circuit(n_qubits=2 + seed % 5, n_gates=40, seed=seed)
+    statevector.check_against_cirq(circuit, resolver, dtype=dtype, atol=atol)
+
+@pytest.mark.parametrize('dtype, atol', [(np.complex64, 1e-5), (np.complex128, 1e-12)])
+def test_sweep_matches_cirq(dtype, atol):
+    circuit, _ = random_circuit(n_qubits=5, n_gates=60, seed=1)
+    symbols = sorted(cirq.parameter_names(circuit))
+    rng = np.random.default_rng(0)
+    resolvers = [cirq.ParamResolver({name: float(rng.uniform(-2, 2)) for name in symbols}) for _ in range(4)]
+
+    expected = [result.final_state_vector for result in cirq.Simulator(dtype=dtype).simulate_sweep(circuit, resolvers)]
+    actual = [state.copy() for state in statevector.simulate_sweep(circuit, resolvers, dtype=dtype)]
+    for state, reference in zip(actual, expected):
+        assert state.dtype == dtype
+        np.testing.assert_allclose(state, reference, rtol=0, atol=atol)
+
+def test_measurements_are_rejected():
+    q = cirq.LineQubit(0)
+    with pytest.raises(ValueError):
+        statevector.compile_circuit(cirq.Circuit([cirq.H(q), cirq.measure(q)]))
@@ -0,0 +1,70 @@
+import gc
+import time
+import numpy as np
+import pytest
+from experiments import derivative
+from experiments.quantum import stft_quantum
+from experiments.stft import stft
+
+SR = 44100
+
+# Reconstruct step of each variant and the batch effect the realtime one must match
+VARIANTS = {
+    'derivative': (lambda: derivative.reconstruct, stft.derivative_effect),
+    'quantum': (stft_quantum.quantum_reconstruct, stft_quantum.quantum_effect),
+}
+
+def synthetic_signal(seconds, seed=0, sr=SR):
+    """A decaying chirp over noise, so every frame has both tones and broadband content."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    chirp = np.sin(2 * np.pi * (110 + 400 * t) * t) * np.exp(-t % 0.5)
+    return (0.5 * chirp + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+def stream(effect, y, blocksize):
+    return np.concatenate([effect.process(y[start:start + blocksize]).copy() for start in range(0, len(y), blocksize)])
+
+@pytest.mark.parametrize('variant', VARIANTS)
+@pytest.mark.parametrize('blocksize', [64, 256, 1000])
+def test_matches_batch_effect_after_latency(variant, blocksize):
+    reconstruct, batch_effect = VARIANTS[variant]
+    y = synthetic_signal(1.0)
+    effect = stft.RealtimeDerivativeEffect(SR, blocksize, reconstruct())
+    streamed = stream(effect, y, blocksize)
+    expected = batch_effect(y, SR)
+
+    # The first latency samples are silence, then the batch effect's output follows
+    assert np.all(streamed[:effect.latency] == 0)
+    n = len(y) - effect.latency
+    np.testing.assert_allclose(streamed[effect.latency:], expected[:n], rtol=0, atol=1e-9)
+
+def test_reset_starts_a_new_stream():
+    y = synthetic_signal(0.2)
+    effect = stft.RealtimeDerivativeEffect(SR, 256)
+    first = stream(effect, y, 256)
+    effect.reset()
+    np.testing.assert_array_equal(stream(effect, y, 256), first)
+
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_every_block_within_its_budget(variant, seconds=10.0, blocksize=256):
+    reconstruct, _ = VARIANTS[variant]
+    y = synthetic_signal(seconds)
+    budget = blocksize / SR
+
+    # Warm up (imports, numba compilation) on a throwaway effect first
+    stream(stft.RealtimeDerivativeEffect(SR, blocksize, reconstruct()), y[:8 * blocksize], blocksize)
+
+    # Time every block with the garbage collector off, as an audio thread would run
+    effect = stft.RealtimeDerivativeEffect(SR, blocksize, reconstruct())
+    slowest = 0.0
+    gc.disable()
+    try:
+        for start in range(0, len(y), blocksize):
+            block = y[start:start + blocksize]
+            started = time.perf_counter()
+            effect.process(block)
+            slowest = max(slowest, time.perf_counter() - started)
+    finally:
+        gc.enable()
+
+    assert slowest <= budget, f'Slowest block took {slowest * 1000:.3g} ms, over its {budget * 1000:.3g} ms budget'
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+import soundfile as sf
+from experiments.stft import stft
+
+SR = 44100
+
+@pytest.fixture(params=[1, 2], ids=['mono', 'stereo'])
+def fixture_file(request, tmp_path):
+    """A short 44.1kHz WAV of a tone over noise per channel, an odd number of samples long."""
+    rng = np.random.default_rng(request.param)
+    t = np.arange(12345) / SR
+    y = np.stack([0.4 * np.sin(2 * np.pi * 220 * (channel + 1) * t) + 0.05 * rng.standard_normal(len(t)) for channel in range(request.param)], axis=-1)
+    path = tmp_path / 'fixture.wav'
+    sf.write(path, y.astype(np.float32), SR, subtype='FLOAT')
+    return str(path), request.param == 1
+
+@pytest.mark.parametrize('blocksize', [50, 300, 1000, 65536])
+def test_streaming_matches_batch(fixture_file, blocksize):
+    input_file, mono = fixture_file
+    # Bit for bit by default
+    assert stft.check_streaming_parity(input_file, blocksize, mono=mono) == 0
+
+def test_streaming_file_matches_batch(fixture_file, tmp_path):
+    input_file, mono = fixture_file
+    stft.process_audio(input_file, str(tmp_path / 'batch.wav'), mono=mono)
+    stft.process_audio_streaming(input_file, str(tmp_path / 'streaming.wav'), blocksize=300, mono=mono)
+    batch, _ = sf.read(tmp_path / 'batch.wav')
+    streaming, _ = sf.read(tmp_path / 'streaming.wav')
+    np.testing.assert_array_equal(streaming, batch)